@@ -0,0 +1,170 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+# Annotations kept in one SQLite database instead of one .txt file per HTML file.
+# Annotations are stored under the file name without extension, the same name the .txt files have.
+# Usage: python annotation_store.py import annotations.sqlite annotation_dir
+#        python annotation_store.py export annotations.sqlite annotation_dir
+
+import os
+import sqlite3
+import threading
+from argparse import ArgumentParser
+from bisect import bisect_left, bisect_right
+from sys import exit
+from time import time
+
+
+# Saved annotations are written together once this many are waiting
+BATCH_SIZE = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS annotations (
+    name TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    modified REAL NOT NULL
+) WITHOUT ROWID
+"""
+
+
+class AnnotationStore:
+    """
+    SQLite database of annotations indexed by file name.
+    put() only queues an annotation, queued annotations are written in one transaction
+    by flush() or when BATCH_SIZE of them are waiting. The store can be read from the
+    loader threads, access to the connection is serialized with a lock.
+    """
+    def __init__(self, path, batch_size=BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = {}  # name -> text not written yet
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(SCHEMA)
+
+    def get(self, name):
+        """Annotation text of name, None if it was never annotated"""
+        with self.lock:
+            if name in self.pending:
+                return self.pending[name]
+            row = self.connection.execute("SELECT text FROM annotations WHERE name = ?", (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, name, text):
+        self.pending[name] = text
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes queued annotations in one transaction"""
+        with self.lock:
+            if not self.pending:
+                return
+            now = time()
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO annotations (name, text, modified) VALUES (?, ?, ?)",
+                    [(name, text, now) for name, text in self.pending.items()])
+            self.pending.clear()
+
+    def names(self):
+        """Names with a non-empty annotation"""
+        self.flush()
+        with self.lock:
+            return {name for name, in self.connection.execute("SELECT name FROM annotations WHERE text != ''")}
+
+    def __len__(self):
+        self.flush()
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM annotations").fetchone()[0]
+
+    def import_txt(self, directory):
+        """Copies the .txt annotation files of directory into the store, returns their number"""
+        count = 0
+        for entry in os.scandir(directory):
+            name, ext = os.path.splitext(entry.name)
+            if ext == ".txt" and entry.is_file():
+                with open(entry.path, 'r', encoding='utf-8') as file:
+                    self.put(name, file.read())
+                count += 1
+        self.flush()
+        return count
+
+    def export_txt(self, directory):
+        """Writes every annotation as a .txt file to directory, returns their number"""
+        self.flush()
+        os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            rows = self.connection.execute("SELECT name, text FROM annotations ORDER BY name").fetchall()
+        for name, text in rows:
+            with open(os.path.join(directory, f"{name}.txt"), 'w', encoding='utf-8') as file:
+                file.write(text)
+        return len(rows)
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+def annotated_txt(directory):
+    """Names of the non-empty .txt annotation files in directory, read in one directory listing"""
+    if not directory or not os.path.isdir(directory):
+        return set()
+    names = set()
+    for entry in os.scandir(directory):
+        name, ext = os.path.splitext(entry.name)
+        if ext == ".txt" and entry.is_file() and entry.stat().st_size > 0:
+            names.add(name)
+    return names
+
+
+class Unannotated:
+    """Sorted positions of the files without annotation in a file list"""
+    def __init__(self, names, annotated):
+        self.positions = [i for i, name in enumerate(names) if name not in annotated]
+
+    def __len__(self):
+        return len(self.positions)
+
+    def next(self, index):
+        """First unannotated position after index, wraps around to the start, None if all are annotated"""
+        i = bisect_right(self.positions, index)
+        if i < len(self.positions):
+            return self.positions[i]
+        return self.positions[0] if self.positions else None
+
+    def mark(self, index, annotated):
+        i = bisect_left(self.positions, index)
+        present = i < len(self.positions) and self.positions[i] == index
+        if annotated and present:
+            del self.positions[i]
+        elif not annotated and not present:
+            self.positions.insert(i, index)
+
+
+def main(args=None):
+    parser = ArgumentParser(description="Copy annotations between a SQLite store and a directory of .txt files.")
+    parser.add_argument("command", choices=["import", "export"], help="import .txt files into the store or export them")
+    parser.add_argument("database", help="SQLite annotation store, created if missing")
+    parser.add_argument("directory", help="directory of .txt annotation files")
+    options = parser.parse_args(args)
+
+    if options.command == "import" and not os.path.isdir(options.directory):
+        print(f"Not a directory: {options.directory}")
+        return 1
+    store = AnnotationStore(options.database)
+    try:
+        if options.command == "import":
+            count = store.import_txt(options.directory)
+            print(f"Imported {count} annotations into {options.database}")
+        else:
+            count = store.export_txt(options.directory)
+            print(f"Exported {count} annotations to {options.directory}")
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,238 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+import os
+import json
+from hashlib import sha1
+from typing import NamedTuple
+
+
+HTML_EXTENSIONS = (".html", ".htm")
+JSON_EXTENSIONS = (".json",)
+ANNOTATION_EXTENSIONS = (".txt",)
+# Persisted indexes are kept here, one file per combination of directories
+INDEX_DIR = os.path.join(os.path.expanduser("~"), ".cache", "HTMLViewer")
+INDEX_VERSION = 1
+
+KINDS = ("html", "json", "annotation")
+EXTENSIONS = {"html": HTML_EXTENSIONS, "json": JSON_EXTENSIONS, "annotation": ANNOTATION_EXTENSIONS}
+STATUSES = ("all", "unannotated", "annotated", "missing_json")
+SORT_KEYS = ("name", "size", "modified")
+
+
+class CorpusEntry(NamedTuple):
+    stem: str
+    html: str
+    size: int
+    modified: float
+    json: str = None  # None if there is no JSON file
+    annotation: str = None  # None if there is no annotation file or it is empty
+
+
+def scan_directory(directory, extensions, stat=True):
+    """
+    Files of directory with one of the extensions, read in one os.scandir pass.
+
+    Parameters:
+    - directory: directory to scan, nothing is returned for ""
+    - extensions: lower case extensions including the dot
+    - stat: read sizes and modification times, otherwise they are 0
+
+    Returns:
+    - dict of file name without extension -> [path, size, modification time]
+    """
+    files = {}
+    if not directory or not os.path.isdir(directory):
+        return files
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            stem, ext = os.path.splitext(entry.name)
+            if ext.lower() in extensions and entry.is_file():
+                if stat:
+                    info = entry.stat()
+                    files[stem] = [entry.path, info.st_size, info.st_mtime]
+                else:
+                    files[stem] = [entry.path, 0, 0]
+    return files
+
+
+def directory_mtime(directory):
+    try:
+        return os.stat(directory).st_mtime_ns
+    except OSError:
+        return None
+
+
+def default_index_path(html_dir, json_dir, annotation_dir):
+    key = sha1("\n".join(os.path.abspath(d) if d else "" for d in (html_dir, json_dir, annotation_dir)).encode()).hexdigest()
+    return os.path.join(INDEX_DIR, f"index-{key[:16]}.json")
+
+
+class CorpusIndex:
+    """
+    HTML files of a directory paired by name with their JSON and annotation files.
+    Every directory is listed once; refresh() lists again only the directory which changed.
+    """
+    def __init__(self, html_dir, json_dir="", annotation_dir=""):
+        self.directories = {"html": html_dir, "json": json_dir or "", "annotation": annotation_dir or ""}
+        self.files = {kind: {} for kind in KINDS}
+        self.mtimes = {}  # directory -> modification time when it was listed
+        self.path = None  # File the index is persisted to
+
+    def scan(self, kinds=KINDS):
+        for kind in kinds:
+            directory = self.directories[kind]
+            # Sizes of JSON files are not needed, only whether they exist
+            self.files[kind] = scan_directory(directory, EXTENSIONS[kind], stat=kind != "json")
+            if directory:
+                self.mtimes[directory] = directory_mtime(directory)
+
+    def refresh(self, directory):
+        """
+        Lists directory again if files were added or removed since the last scan, otherwise only
+        the indexed files are checked for changes. Returns True if anything changed.
+        """
+        directory = os.path.normpath(directory)
+        kinds = [kind for kind, d in self.directories.items() if d and os.path.normpath(d) == directory]
+        if not kinds:
+            return False
+        original = self.directories[kinds[0]]
+        if directory_mtime(original) != self.mtimes.get(original):
+            self.scan(kinds)
+            return True
+        # Files written in place do not change the modification time of their directory
+        return any([self.update_files(kind) for kind in kinds])
+
+    def update_files(self, kind):
+        """Reads sizes and modification times of the indexed files of kind again, returns True if any changed"""
+        if kind == "json":
+            return False  # Only whether JSON files exist is indexed
+        files = self.files[kind]
+        changed = False
+        for stem, (path, size, modified) in list(files.items()):
+            try:
+                info = os.stat(path)
+            except OSError:
+                del files[stem]
+                changed = True
+                continue
+            if info.st_size != size or info.st_mtime != modified:
+                files[stem] = [path, info.st_size, info.st_mtime]
+                changed = True
+        return changed
+
+    def update_annotation(self, path):
+        """Updates one annotation file, e.g. after it was saved, without listing its directory"""
+        stem = os.path.splitext(os.path.basename(path))[0]
+        try:
+            info = os.stat(path)
+            self.files["annotation"][stem] = [path, info.st_size, info.st_mtime]
+        except OSError:
+            self.files["annotation"].pop(stem, None)
+
+    def annotated(self):
+        """Names of the HTML files with a non-empty annotation file"""
+        return {stem for stem, (_, size, _) in self.files["annotation"].items() if size > 0}
+
+    def entry(self, stem):
+        """CorpusEntry of one HTML file, None if it is not indexed"""
+        html = self.files["html"].get(stem)
+        if html is None:
+            return None
+        json_file = self.files["json"].get(stem)
+        annotation_file = self.files["annotation"].get(stem)
+        return CorpusEntry(stem, *html, json_file[0] if json_file else None,
+                           annotation_file[0] if annotation_file and annotation_file[1] > 0 else None)
+
+    def entries(self):
+        return [self.entry(stem) for stem in self.files["html"]]
+
+    def select(self, status="all", sort="name", annotated=None, keep=()):
+        """
+        Entries filtered by completion status and sorted.
+
+        Parameters:
+        - status: one of STATUSES
+        - sort: one of SORT_KEYS
+        - annotated: names counted as annotated, e.g. from an annotation database,
+          by default the names with an annotation file
+        - keep: names selected whatever their status, e.g. the file being annotated
+
+        Returns:
+        - list of CorpusEntry
+        """
+        if annotated is None:
+            annotated = self.annotated()
+        entries = self.entries()
+        if status == "unannotated":
+            entries = [e for e in entries if e.stem not in annotated or e.stem in keep]
+        elif status == "annotated":
+            entries = [e for e in entries if e.stem in annotated or e.stem in keep]
+        elif status == "missing_json":
+            entries = [e for e in entries if e.json is None or e.stem in keep]
+        if sort == "size":
+            entries.sort(key=lambda e: (e.size, e.stem))
+        elif sort == "modified":
+            entries.sort(key=lambda e: (e.modified, e.stem))
+        else:
+            entries.sort(key=lambda e: e.stem)
+        return entries
+
+    def counts(self, annotated=None):
+        """Number of HTML files, annotated ones and ones without JSON"""
+        if annotated is None:
+            annotated = self.annotated()
+        html = self.files["html"]
+        return {"files": len(html),
+                "annotated": sum(1 for stem in html if stem in annotated),
+                "missing_json": sum(1 for stem in html if stem not in self.files["json"])}
+
+    def save(self, path=None):
+        path = path or self.path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        data = {"version": INDEX_VERSION, "directories": self.directories, "files": self.files,
+                "mtimes": self.mtimes}
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, html_dir, json_dir="", annotation_dir=""):
+        """Index saved by save(), None if it is missing or belongs to other directories"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        index = cls(html_dir, json_dir, annotation_dir)
+        if data.get("version") != INDEX_VERSION or data.get("directories") != index.directories:
+            return None
+        index.files = data["files"]
+        index.mtimes = data["mtimes"]
+        return index
+
+    @classmethod
+    def open(cls, html_dir, json_dir="", annotation_dir="", index_path=None):
+        """
+        Index of the directories, read from index_path. Only directories which changed since
+        the index was saved are listed again. Pass index_path=False to not persist the index.
+        """
+        if index_path is None:
+            index_path = default_index_path(html_dir, json_dir, annotation_dir)
+        index = cls.load(index_path, html_dir, json_dir, annotation_dir) if index_path else None
+        if index is None:
+            index = cls(html_dir, json_dir, annotation_dir)
+            index.scan()
+            changed = True
+        else:
+            changed = False
+            for directory in {d for d in index.directories.values() if d}:
+                changed |= index.refresh(directory)
+        index.path = index_path or None
+        if changed and index_path:
+            try:
+                index.save(index_path)
+            except OSError:
+                pass  # The index is only a start-up speed up
+        return index
@@ -0,0 +1,192 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+# Headless validation and export of the HTML/JSON/annotation files, runs without PyQt5.
+# Usage: python export_corpus.py HTML_DIR --json-dir DIR --annotation-dir DIR [-o dataset.jsonl]
+#    or: python export_corpus.py HTML_DIR --json-dir DIR --store annotations.sqlite -o dataset.parquet
+
+import os
+import json
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from sys import exit
+from typing import NamedTuple
+
+from annotation_store import AnnotationStore
+from corpus_index import CorpusIndex, STATUSES
+
+try:
+    # Optional, needed only for .parquet output
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+# Files read together by the thread pool, only one batch is kept in memory
+BATCH_FILES = 256
+# Reading is I/O bound, more threads than cores help on network shares
+WORKERS = 8
+
+
+class Record(NamedTuple):
+    name: str
+    html: str = None
+    json: object = None  # Parsed JSON, None if it is missing or invalid
+    json_error: str = None
+    annotation: str = None  # None if the file is not annotated
+    error: str = None  # The HTML file could not be read
+
+
+def read_record(entry, store=None, include_html=True):
+    """Reads and validates the files of one CorpusEntry"""
+    html, data, json_error, annotation, error = None, None, None, None, None
+    if include_html:
+        try:
+            with open(entry.html, 'r', encoding='utf-8') as file:
+                html = file.read()
+        except (OSError, UnicodeDecodeError) as e:
+            error = f"{type(e).__name__}: {e}"
+
+    if entry.json is not None:
+        try:
+            with open(entry.json, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            json_error = f"{type(e).__name__}: {e}"
+
+    if store is not None:
+        annotation = store.get(entry.stem) or None
+    elif entry.annotation is not None:
+        try:
+            with open(entry.annotation, 'r', encoding='utf-8') as file:
+                annotation = file.read()
+        except (OSError, UnicodeDecodeError) as e:
+            error = error or f"{type(e).__name__}: {e}"
+    return Record(entry.stem, html, data, json_error, annotation, error)
+
+
+class JsonlWriter:
+    def __init__(self, path):
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, records):
+        for record in records:
+            self.file.write(json.dumps(record._asdict(), ensure_ascii=False) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    """Parquet file with the JSON column stored as JSON text"""
+    def __init__(self, path):
+        self.schema = pyarrow.schema([(name, pyarrow.string()) for name in Record._fields])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, records):
+        rows = [record._replace(json=None if record.json is None else json.dumps(record.json, ensure_ascii=False))._asdict()
+                for record in records]
+        self.writer.write_table(pyarrow.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def export(entries, writer=None, store=None, include_html=True, workers=WORKERS):
+    """
+    Reads the entries on a thread pool and passes them to writer in their order.
+
+    Parameters:
+    - entries: CorpusEntry list, e.g. from CorpusIndex.select
+    - writer: JsonlWriter, ParquetWriter or None to only validate
+    - store: AnnotationStore to read the annotations from instead of the .txt files
+    - include_html: read the HTML files, they are always read if there is a writer
+
+    Returns:
+    - list of Record without the HTML and JSON content, for the report
+    """
+    include_html = include_html or writer is not None
+    summary = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for i in range(0, len(entries), BATCH_FILES):
+            records = list(pool.map(lambda entry: read_record(entry, store, include_html), entries[i:i + BATCH_FILES]))
+            if writer is not None:
+                writer.write(records)
+            # Only the state of the files is kept for the report
+            summary += [record._replace(html=None, json=None, annotation=None if record.annotation is None else "")
+                        for record in records]
+    return summary
+
+
+def write_report(path, entries, records):
+    """Writes the problems of every file to a semicolon separated file"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("Name;JSON;Annotation;Error\n")
+        for entry, record in zip(entries, records):
+            if entry.json is None:
+                json_state = "missing"
+            else:
+                json_state = "invalid" if record.json_error else "ok"
+            annotation = "ok" if record.annotation is not None else "missing"
+            error = (record.json_error or record.error or "").replace(";", ",").replace("\n", " ")
+            f.write(f"{record.name};{json_state};{annotation};{error}\n")
+
+
+def build_parser():
+    parser = ArgumentParser(description="Validate the HTML, JSON and annotation files and export them to one dataset.")
+    parser.add_argument("html_dir", help="folder with the HTML files")
+    parser.add_argument("--json-dir", default="", help="folder with the JSON files")
+    parser.add_argument("--annotation-dir", default="", help="folder with the txt annotation files")
+    parser.add_argument("--store", default=None, help="SQLite annotation database used instead of the txt files")
+    parser.add_argument("-o", "--output", default=None, help="dataset file, .jsonl or .parquet (default: only validate)")
+    parser.add_argument("--status", choices=STATUSES, default="all", help="files to export (default: %(default)s)")
+    parser.add_argument("--report", default=None, help="write the state of every file to this semicolon separated file")
+    parser.add_argument("-j", "--workers", type=int, default=WORKERS, help="number of reading threads (default: %(default)s)")
+    return parser
+
+
+def main(args=None):
+    options = build_parser().parse_args(args)
+    if not os.path.isdir(options.html_dir):
+        print(f"Not a directory: {options.html_dir}")
+        return 2
+    parquet = options.output is not None and options.output.endswith(".parquet")
+    if parquet and pyarrow is None:
+        print("Parquet output needs pyarrow, install it or use a .jsonl output")
+        return 2
+    if options.store is not None and not os.path.exists(options.store):
+        print(f"Annotation database not found: {options.store}")
+        return 2
+
+    index = CorpusIndex.open(options.html_dir, options.json_dir, options.annotation_dir, index_path=False)
+    store = AnnotationStore(options.store) if options.store else None
+    writer = None
+    try:
+        annotated = store.names() if store is not None else None
+        entries = index.select(options.status, "name", annotated)
+        if options.output:
+            writer = ParquetWriter(options.output) if parquet else JsonlWriter(options.output)
+        records = export(entries, writer, store, include_html=False, workers=options.workers)
+    finally:
+        if writer is not None:
+            writer.close()
+        if store is not None:
+            store.close()
+
+    if options.report:
+        write_report(options.report, entries, records)
+    invalid = [r for r in records if r.json_error or r.error]
+    missing_json = sum(1 for e in entries if e.json is None)
+    missing_annotation = sum(1 for r in records if r.annotation is None)
+    print(f"Checked {len(records)} files: {missing_json} without JSON, {missing_annotation} without annotation, "
+          f"{len(invalid)} unreadable")
+    for r in invalid:
+        print(f"  {r.name}: {(r.json_error or r.error).splitlines()[0]}")
+    if options.output:
+        print(f"Dataset written to {options.output}")
+    return 1 if invalid else 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,136 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+from json_model import load_json
+from latency import LatencyRecorder
+
+
+class LoadedFile(NamedTuple):
+    json: object = None  # Parsed JSON or a JsonStream, None if there is no JSON file
+    json_error: str = None  # Message shown instead of invalid JSON
+    annotation: str = None  # None if there is no annotation file
+    html: object = None  # HTML file prepared for rendering, None if it was not read
+
+
+def companion_path(file_path, directory, extension):
+    """Path of the file with the same name as file_path in another directory"""
+    return os.path.join(directory, f"{file_stem(file_path)}{extension}")
+
+
+def file_stem(file_path):
+    """File name without directory and extension, annotations are stored under it"""
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+
+def read_files(file_path, json_file, annotation_file, store=None, prepare_html=None, recorder=None):
+    """
+    Reads the JSON and annotation files belonging to an HTML file, the annotation from store if it is given.
+    json_file and annotation_file are None if it is known that there is no such file.
+    If prepare_html is given, the HTML file is read and passed through it too.
+    Reading times are recorded with recorder, a LatencyRecorder.
+    """
+    recorder = recorder or LatencyRecorder()
+    name = os.path.basename(file_path)
+    data, json_error = None, None
+    # Files are opened directly, a missing file costs no extra existence check
+    with recorder.span("read_json", file=name):
+        try:
+            if json_file is not None:
+                data = load_json(json_file)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            json_error = f"Invalid JSON in {json_file}:\n{e}"
+
+    annotation = None
+    with recorder.span("read_annotation", file=name):
+        if store is not None:
+            annotation = store.get(file_stem(file_path))
+        elif annotation_file is not None:
+            try:
+                with open(annotation_file, 'r', encoding='utf-8') as file:
+                    annotation = file.read()
+            except FileNotFoundError:
+                pass
+    html = None
+    if prepare_html is not None:
+        with recorder.span("read_html", file=name):
+            with open(file_path, 'r', encoding='utf-8', errors='replace') as file:
+                html = prepare_html(file.read())
+    return LoadedFile(data, json_error, annotation, html)
+
+
+class FileLoader:
+    """
+    Loads files on background threads and keeps them in a bounded LRU cache.
+    After a file is shown, its neighbours in the file list are prefetched,
+    so moving to the next or previous file does not wait for the disk.
+    """
+    def __init__(self, ahead=3, behind=1, cache_size=32, workers=2):
+        self.ahead = ahead
+        self.behind = behind
+        self.cache_size = max(cache_size, ahead + behind + 1)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.cache = OrderedDict()  # key -> Future of LoadedFile
+        self.store = None  # AnnotationStore used instead of the .txt files
+        self.prepare_html = None  # Function preparing HTML files for rendering
+        self.recorder = None  # LatencyRecorder of the reading times
+
+    def submit(self, file_path, json_file, annotation_file):
+        key = (file_path, json_file, annotation_file)
+        future = self.cache.get(key)
+        if future is None:
+            future = self.pool.submit(read_files, file_path, json_file, annotation_file, self.store,
+                                      self.prepare_html, self.recorder)
+            self.cache[key] = future
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            _, old = self.cache.popitem(last=False)
+            old.cancel()  # Only stops loads which did not start yet
+        return future
+
+    def get(self, file_path, json_file, annotation_file):
+        """LoadedFile of file_path, waits only if it was not prefetched yet"""
+        future = self.submit(file_path, json_file, annotation_file)
+        try:
+            return future.result()
+        except Exception:
+            # Do not keep the failure, the next visit tries again
+            self.cache.pop((file_path, json_file, annotation_file), None)
+            raise
+
+    def prefetch(self, file_list, index, companions):
+        """
+        Starts loading the neighbours of file_list[index], the next files first.
+        companions returns the JSON and annotation file of an HTML file, see read_files.
+        """
+        neighbours = list(range(index + 1, index + 1 + self.ahead)) + list(range(index - 1, index - 1 - self.behind, -1))
+        for i in neighbours:
+            if 0 <= i < len(file_list):
+                self.submit(file_list[i], *companions(file_list[i]))
+        # The shown file stays the most recently used one
+        key = (file_list[index], *companions(file_list[index]))
+        if key in self.cache:
+            self.cache.move_to_end(key)
+
+    def invalidate(self, file_path):
+        """Forgets cached content of file_path, e.g. after its annotation was saved"""
+        for key in [key for key in self.cache if key[0] == file_path]:
+            self.cache.pop(key).cancel()
+
+    def set_store(self, store):
+        self.store = store
+        self.clear()
+
+    def set_prepare_html(self, prepare_html):
+        self.prepare_html = prepare_html
+        self.clear()
+
+    def clear(self):
+        for future in self.cache.values():
+            future.cancel()
+        self.cache.clear()
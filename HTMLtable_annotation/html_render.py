@@ -0,0 +1,161 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+# Faster ways of showing table-only HTML files than loading each of them as a new web page.
+#   "swap":  one page is loaded once and only its content is replaced with JavaScript
+#   "table": the <table> is parsed and shown in a QTableView, no web engine is involved
+# Files which need a real page load (scripts, frames, stylesheet links) fall back to the full web view.
+
+import json
+import re
+from html.parser import HTMLParser
+from typing import NamedTuple
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+
+
+# Text and value of the render mode selection
+RENDER_MODES = [("Web page", "full"), ("Fast web page", "swap"), ("Table", "table")]
+
+# Page loaded once in "swap" mode, the base element keeps relative links of the files working
+SHELL_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><base id="base" href=""><style id="style"></style></head>
+<body></body></html>"""
+
+BODY_PATTERN = re.compile(r"<body[^>]*>(.*)</body>", re.IGNORECASE | re.DOTALL)
+STYLE_PATTERN = re.compile(r"<style[^>]*>(.*?)</style>", re.IGNORECASE | re.DOTALL)
+# Content which does not work when it is inserted into another page
+FULL_LOAD_PATTERN = re.compile(r"<script|<i?frame|<link[^>]+stylesheet|<base", re.IGNORECASE)
+
+
+class PageContent(NamedTuple):
+    body: str
+    styles: str
+    simple: bool  # False if the file has to be loaded as its own page
+
+
+class TableContent(NamedTuple):
+    rows: list
+    header: list = None  # Cells of the first row if it has only <th> cells
+
+
+def prepare_page(html):
+    """Body and styles of an HTML file for the "swap" mode"""
+    match = BODY_PATTERN.search(html)
+    body = match.group(1) if match else html
+    styles = "\n".join(STYLE_PATTERN.findall(html))
+    if not match:
+        # A fragment without <body>, its styles are passed separately
+        body = STYLE_PATTERN.sub("", body)
+    return PageContent(body, styles, FULL_LOAD_PATTERN.search(html) is None)
+
+
+def swap_script(content, base_url):
+    """JavaScript which replaces the content of SHELL_PAGE"""
+    return (f"document.getElementById('base').href = {json.dumps(base_url)};"
+            f"document.getElementById('style').textContent = {json.dumps(content.styles)};"
+            f"document.body.innerHTML = {json.dumps(content.body)};"
+            "window.scrollTo(0, 0);")
+
+
+class TableParser(HTMLParser):
+    """Text of the cells of the top level tables, nested tables become text of their cell"""
+    def __init__(self):
+        super().__init__()
+        self.depth = 0  # Nesting of <table> elements
+        self.rows = []
+        self.header_row = []  # True for every row with only <th> cells
+        self.cell = None  # Text parts of the open cell
+        self.cell_span = 1
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "table":
+            self.depth += 1
+        elif self.depth == 1 and tag == "tr":
+            self.close_cell()
+            self.rows.append([])
+            self.header_row.append(True)
+        elif self.depth == 1 and tag in ("td", "th"):
+            self.close_cell()
+            if not self.rows:
+                self.rows.append([])
+                self.header_row.append(True)
+            if tag == "td":
+                self.header_row[-1] = False
+            self.cell = []
+            try:
+                self.cell_span = max(1, int(dict(attrs).get("colspan") or 1))
+            except ValueError:
+                self.cell_span = 1
+        elif self.cell is not None and tag in ("br", "p", "div", "tr", "td", "th"):
+            # Also between the cells of a nested table, their words stay apart
+            self.cell.append(" ")
+
+    def handle_endtag(self, tag):
+        if tag == "table":
+            if self.depth == 1:
+                self.close_cell()
+            self.depth = max(0, self.depth - 1)
+        elif self.depth == 1 and tag in ("td", "th", "tr"):
+            self.close_cell()
+
+    def handle_data(self, data):
+        if self.cell is not None:
+            self.cell.append(data)
+
+    def close_cell(self):
+        if self.cell is not None:
+            # Spanned columns get empty cells so the following cells stay in their column
+            self.rows[-1] += [" ".join("".join(self.cell).split())] + [""] * (self.cell_span - 1)
+            self.cell = None
+            self.cell_span = 1
+
+
+def parse_table(html):
+    """TableContent of the tables in an HTML file, None if there is no table"""
+    parser = TableParser()
+    parser.feed(html)
+    parser.close()
+    parser.close_cell()
+    rows = [(row, only_th) for row, only_th in zip(parser.rows, parser.header_row) if row]
+    if not rows:
+        return None
+    header = None
+    if rows[0][1] and len(rows) > 1:
+        header, rows = rows[0][0], rows[1:]
+    rows = [row for row, _ in rows]
+    return TableContent(rows, header)
+
+
+class HtmlTableModel(QAbstractTableModel):
+    """Read-only model of a TableContent"""
+    def __init__(self, content=None, parent=None):
+        super().__init__(parent)
+        self.rows = content.rows if content is not None else []
+        self.header = content.header if content is not None else None
+        self.columns = max([len(row) for row in self.rows] + [len(self.header or [])])
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.columns
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+        row = self.rows[index.row()]
+        return row[index.column()] if index.column() < len(row) else ""
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole and self.header and section < len(self.header):
+            return self.header[section]
+        return super().headerData(section, orientation, role)
+
+
+def prepare(html, mode):
+    """Content of an HTML file for a render mode, done on the loader threads"""
+    if mode == "swap":
+        return prepare_page(html)
+    if mode == "table":
+        return parse_table(html)
+    return None
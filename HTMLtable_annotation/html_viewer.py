@@ -2,20 +2,54 @@ __author__ = "Tomasz Galica"
 __license__ = "GNU"
 
 import sys
-from PyQt5.QtWidgets import QApplication, QMainWindow, QPushButton, QLabel, QFileDialog, QVBoxLayout, QHBoxLayout, QWidget, QTextEdit, QDialog, QSplitter
+from PyQt5.QtWidgets import QApplication, QMainWindow, QPushButton, QLabel, QFileDialog, QVBoxLayout, QHBoxLayout, QWidget, QTextEdit, QSplitter, QTreeView, QMessageBox, QComboBox, QStackedWidget, QTableView
 from PyQt5.QtWebEngineWidgets import QWebEngineView
-from PyQt5.QtCore import QUrl, Qt
+from PyQt5.QtCore import QUrl, Qt, QTimer, QFileSystemWatcher
 import os
-import json
+from argparse import ArgumentParser
+from functools import partial
+from file_loader import FileLoader, companion_path, file_stem
+from json_model import JsonTreeModel
+from annotation_store import AnnotationStore, Unannotated, annotated_txt
+from corpus_index import CorpusIndex
+from raw_viewer import RawHtmlDialog
+from html_render import RENDER_MODES, SHELL_PAGE, PageContent, TableContent, HtmlTableModel, prepare, swap_script
+from latency import LatencyRecorder, TRACE_ENV
+
+# Number of files loaded in advance after and before the shown one
+PREFETCH_AHEAD = 3
+PREFETCH_BEHIND = 1
+# JSON with at most this many top level items is shown with the first level expanded
+EXPAND_ROWS = 20
+# Annotations typed into a database are saved after this many ms without typing
+AUTOSAVE_MS = 1000
+# Changes of the opened folders are applied after this many ms without further changes
+REFRESH_MS = 500
+# Filters and sort orders of an opened folder, see CorpusIndex.select
+STATUS_FILTERS = [("All files", "all"), ("Unannotated", "unannotated"), ("Annotated", "annotated"),
+                  ("Missing JSON", "missing_json")]
+SORT_ORDERS = [("Sort by name", "name"), ("Sort by size", "size"), ("Sort by date", "modified")]
 
 class HTMLViewer(QMainWindow):
-    def __init__(self):
+    def __init__(self, trace=None):
         super().__init__()
 
         self.file_list = []
         self.current_index = 0
         self.annotation_dir = ""  # Directory to save annotations
         self.json_dir = ""  # Directory to find JSON files
+        self.loader = FileLoader(PREFETCH_AHEAD, PREFETCH_BEHIND)
+        # Latency measurement, only if a trace file is given
+        self.latency = LatencyRecorder(trace)
+        self.loader.recorder = self.latency
+        self.store = None  # Optional AnnotationStore replacing the .txt files
+        self.shown_index = None  # Index of the file the annotation text belongs to
+        self.unannotated = Unannotated([], set())
+        self.corpus = None  # CorpusIndex of a folder opened with "Open Folder"
+        self.changed_dirs = set()
+        self.shell_loaded = False  # SHELL_PAGE is shown and its content can be replaced
+        self.pending_script = None  # Content swap waiting for SHELL_PAGE to load
+        self.raw_dialog = None  # Raw HTML dialog, kept after it is closed
 
         self.initUI()
 
@@ -31,13 +65,22 @@ class HTMLViewer(QMainWindow):
         # Create a splitter to separate HTML and JSON display areas
         self.splitter = QSplitter(Qt.Horizontal)
 
-        # Create the QWebEngineView to display HTML content
+        # Create the QWebEngineView to display HTML content and a table view for the "Table" mode
+        self.html_stack = QStackedWidget(self)
         self.web_view = QWebEngineView(self)
-        self.splitter.addWidget(self.web_view)
-
-        # Create a QTextEdit widget to display JSON content
-        self.json_view = QTextEdit(self)
-        self.json_view.setReadOnly(True)
+        self.web_view.loadFinished.connect(self.on_load_finished)
+        self.html_stack.addWidget(self.web_view)
+        self.table_view = QTableView(self)
+        self.table_view.setModel(HtmlTableModel())
+        self.html_stack.addWidget(self.table_view)
+        self.splitter.addWidget(self.html_stack)
+
+        # Create a tree view to display JSON content, rows are created only when nodes are expanded
+        self.json_view = QTreeView(self)
+        self.json_view.setUniformRowHeights(True)
+        self.json_model = JsonTreeModel()
+        self.json_view.setModel(self.json_model)
+        self.json_view.setColumnWidth(0, 250)
         self.splitter.addWidget(self.json_view)
 
         # Set the initial splitter ratio
@@ -60,12 +103,49 @@ class HTMLViewer(QMainWindow):
         self.load_button.clicked.connect(self.load_files)
         self.top_layout.addWidget(self.load_button)
 
+        # Create a button to open every HTML file of a folder
+        self.open_folder_button = QPushButton("Open Folder", self)
+        self.open_folder_button.clicked.connect(self.open_folder)
+        self.top_layout.addWidget(self.open_folder_button)
+
+        # Create filter and sort selections of the opened folder
+        self.status_box = QComboBox(self)
+        self.sort_box = QComboBox(self)
+        for box, items in ((self.status_box, STATUS_FILTERS), (self.sort_box, SORT_ORDERS)):
+            for text, value in items:
+                box.addItem(text, value)
+            box.setEnabled(False)
+            box.currentIndexChanged.connect(self.apply_filter)
+            self.top_layout.addWidget(box)
+
+        # Create a selection of the way HTML files are shown
+        self.render_box = QComboBox(self)
+        for text, value in RENDER_MODES:
+            self.render_box.addItem(text, value)
+        self.render_box.currentIndexChanged.connect(self.on_render_mode_changed)
+        self.top_layout.addWidget(self.render_box)
+
+        # Files added to the opened folders are picked up by the watcher
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.on_directory_changed)
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(REFRESH_MS)
+        self.refresh_timer.timeout.connect(self.refresh_corpus)
+
         # Create a QTextEdit widget for annotations
         self.annotation_text = QTextEdit(self)
         self.annotation_text.setPlaceholderText("Write your annotation here...")
         self.annotation_text.setMaximumHeight(400)
+        self.annotation_text.textChanged.connect(self.on_annotation_changed)
         self.main_layout.addWidget(self.annotation_text)
 
+        # Autosave of the annotation when a database is used
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.setSingleShot(True)
+        self.autosave_timer.setInterval(AUTOSAVE_MS)
+        self.autosave_timer.timeout.connect(self.autosave)
+
         # Create a button to open HTML as text
         self.open_as_text_button = QPushButton("Open HTML as Text", self)
         self.open_as_text_button.clicked.connect(self.open_as_text)
@@ -78,6 +158,23 @@ class HTMLViewer(QMainWindow):
         self.save_button.setMaximumHeight(30)
         self.top_layout.addWidget(self.save_button)
 
+        # Create a button to jump to the next file without annotation
+        self.next_unannotated_button = QPushButton("Next Unannotated", self)
+        self.next_unannotated_button.clicked.connect(self.next_unannotated)
+        self.next_unannotated_button.setMaximumHeight(30)
+        self.top_layout.addWidget(self.next_unannotated_button)
+
+        # Create a button to keep annotations in a database instead of txt files
+        self.store_button = QPushButton("Annotation Database", self)
+        self.store_button.clicked.connect(self.open_store)
+        self.store_button.setMaximumHeight(30)
+        self.top_layout.addWidget(self.store_button)
+
+        # Create a label with the navigation latency percentiles
+        if self.latency.enabled:
+            self.latency_label = QLabel(self.latency.summary("navigate"), self)
+            self.statusBar().addPermanentWidget(self.latency_label)
+
         # Enable keyboard navigation
         self.central_widget.setFocus()
         self.central_widget.keyPressEvent = self.keyPressEvent
@@ -87,9 +184,12 @@ class HTMLViewer(QMainWindow):
         options = QFileDialog.Options()
         files, _ = QFileDialog.getOpenFileNames(self, "Select HTML Files", "", "HTML Files (*.html);;All Files (*)", options=options)
         if files:
+            self.autosave()
+            self.set_corpus(None)
             self.file_list = files
             self.current_index = 0
-            self.show_file(self.file_list[self.current_index])
+            self.shown_index = None
+            self.loader.clear()
 
             # Prompt user for the directory to save annotations
             self.annotation_dir = QFileDialog.getExistingDirectory(self, "Select Directory to Save Annotations")
@@ -101,43 +201,323 @@ class HTMLViewer(QMainWindow):
             if not self.json_dir:
                 self.json_dir = ""  # Reset if no directory is chosen
 
+            self.update_unannotated()
+            self.show_file(self.file_list[self.current_index])
+
+    def open_folder(self):
+        """Select a folder with HTML files, they are paired with JSON and annotation files by name"""
+        html_dir = QFileDialog.getExistingDirectory(self, "Select Directory with HTML Files")
+        if not html_dir:
+            return
+        annotation_dir = QFileDialog.getExistingDirectory(self, "Select Directory to Save Annotations")
+        json_dir = QFileDialog.getExistingDirectory(self, "Select Directory to Find JSON Files")
+
+        self.autosave()
+        self.annotation_dir = annotation_dir or ""
+        self.json_dir = json_dir or ""
+        self.loader.clear()
+        self.shown_index = None
+        self.file_list = []
+        self.set_corpus(CorpusIndex.open(html_dir, self.json_dir, self.annotation_dir))
+        self.apply_filter()
+
+    def set_corpus(self, corpus):
+        self.save_corpus()
+        self.corpus = corpus
+        if self.watcher.directories():
+            self.watcher.removePaths(self.watcher.directories())
+        if corpus is not None:
+            self.watcher.addPaths(sorted({d for d in corpus.directories.values() if d}))
+        for box in (self.status_box, self.sort_box):
+            box.setEnabled(corpus is not None)
+
+    def save_corpus(self):
+        if self.corpus is not None and self.corpus.path:
+            try:
+                self.corpus.save()
+            except OSError:
+                pass  # The index is only a start-up speed up
+
+    def apply_filter(self):
+        """Shows the files of the opened folder which pass the selected filter, in the selected order"""
+        self.filter_files()
+
+    def filter_files(self, keep_current=False):
+        """
+        Shows the files of the opened folder which pass the filter, in the selected order.
+        With keep_current the shown file stays in the list even if it does not pass the filter any more,
+        e.g. after its annotation was saved with the "Unannotated" filter.
+        """
+        if self.corpus is None:
+            return
+        current = self.file_list[self.current_index] if self.file_list else None
+        annotated = self.store.names() if self.store is not None else None
+        keep = [file_stem(current)] if keep_current and current is not None and self.shown_index is not None else ()
+        entries = self.corpus.select(self.status_box.currentData(), self.sort_box.currentData(), annotated, keep)
+
+        # The annotation text belongs to a position in the old list
+        self.autosave()
+        self.file_list = [entry.html for entry in entries]
+        self.update_unannotated()
+        if not self.file_list:
+            self.shown_index = None
+            self.current_index = 0
+            self.statusBar().showMessage("No files match the filter")
+            return
+        if current in self.file_list and self.shown_index is not None:
+            # The shown file stays, only its position changes
+            self.current_index = self.shown_index = self.file_list.index(current)
+            self.statusBar().showMessage(f"File {self.current_index+1}/{len(self.file_list)}, {len(self.unannotated)} unannotated")
+        else:
+            self.current_index = min(self.current_index, len(self.file_list) - 1)
+            self.show_file(self.file_list[self.current_index])
+
+    def on_directory_changed(self, path):
+        self.changed_dirs.add(path)
+        self.refresh_timer.start()
+
+    def refresh_corpus(self):
+        """Lists again the folders which changed and updates the file list"""
+        if self.corpus is None:
+            return
+        changed = [self.corpus.refresh(directory) for directory in self.changed_dirs]
+        self.changed_dirs.clear()
+        if any(changed):
+            self.loader.clear()
+            self.save_corpus()
+            # The file being annotated stays until the user moves to another one
+            self.filter_files(keep_current=True)
+
     def show_file(self, file_path):
         """Display HTML, JSON and corresponding annotation file"""
+        if self.store is not None:
+            # Annotation of the previous file is written with the next autosave
+            self.autosave(flush=False)
+            if self.store.pending:
+                self.autosave_timer.start()
         file_name = os.path.basename(file_path)
+        self.latency.begin("navigate", file=file_name)
         self.label.setText(f"Viewing: {file_name}")
-        self.web_view.setUrl(QUrl.fromLocalFile(file_path))
 
-        # Load the corresponding JSON file if available
-        json_file = os.path.join(self.json_dir, f"{os.path.splitext(file_name)[0]}.json")
-        if os.path.exists(json_file):
-            with open(json_file, 'r', encoding='utf-8') as file:
-                json_data = json.load(file)
-                formatted_json = json.dumps(json_data, indent=4)
-                self.json_view.setPlainText(formatted_json)
-        else:
-            self.json_view.setPlainText("")
-        self.statusBar().showMessage(f"File {self.current_index+1}/{len(self.file_list)}")
+        # JSON, annotation and HTML files are usually prefetched already
+        with self.latency.span("load_wait", file=file_name):
+            loaded = self.loader.get(file_path, *self.companions(file_path))
+        rendering = self.show_html(file_path, loaded.html)
+        with self.latency.span("json_view", file=file_name):
+            self.show_json(loaded)
+        self.statusBar().showMessage(f"File {self.current_index+1}/{len(self.file_list)}, {len(self.unannotated)} unannotated")
 
         # Load existing annotation if available
-        annotation_file = os.path.join(self.annotation_dir, f"{os.path.splitext(file_name)[0]}.txt")
-        if os.path.exists(annotation_file):
-            with open(annotation_file, 'r', encoding='utf-8') as file:
-                self.annotation_text.setPlainText(file.read())
+        if loaded.annotation is not None:
+            self.annotation_text.setPlainText(loaded.annotation)
         else:
             self.annotation_text.clear()
+        self.annotation_text.document().setModified(False)
+        self.shown_index = self.current_index
+
+        # An open raw HTML dialog follows the shown file
+        if self.raw_dialog is not None and self.raw_dialog.isVisible():
+            self.raw_dialog.open_file(file_path)
+
+        # Start loading the neighbours for arrow key navigation
+        self.loader.prefetch(self.file_list, self.current_index, self.companions)
+        if not rendering:
+            self.on_rendered()
+
+    def companions(self, file_path):
+        """JSON and annotation file of an HTML file, taken from the folder index if a folder is open"""
+        if self.corpus is not None:
+            entry = self.corpus.entry(file_stem(file_path))
+            if entry is not None:
+                return entry.json, entry.annotation
+        return companion_path(file_path, self.json_dir, ".json"), companion_path(file_path, self.annotation_dir, ".txt")
+
+    def show_html(self, file_path, content):
+        """
+        Show the HTML file in the selected mode, files the mode cannot show are loaded as a page.
+        Returns True if the content is shown later, on_rendered is called then.
+        """
+        if isinstance(content, TableContent):
+            with self.latency.span("render", mode="table"):
+                self.table_view.setModel(HtmlTableModel(content))
+                self.html_stack.setCurrentWidget(self.table_view)
+            return False
+
+        self.html_stack.setCurrentWidget(self.web_view)
+        if isinstance(content, PageContent) and content.simple:
+            self.latency.begin("render", mode="swap")
+            script = swap_script(content, QUrl.fromLocalFile(os.path.dirname(file_path) + os.sep).toString())
+            if self.shell_loaded:
+                self.web_view.page().runJavaScript(script, self.on_rendered)
+            else:
+                # The content is swapped in when the page has loaded
+                self.pending_script = script
+                self.web_view.setHtml(SHELL_PAGE, QUrl.fromLocalFile(file_path))
+            return True
+
+        self.latency.begin("render", mode="full")
+        self.shell_loaded = False
+        self.pending_script = None
+        self.web_view.setUrl(QUrl.fromLocalFile(file_path))
+        return True
+
+    def on_load_finished(self, ok):
+        # A failed load can be the previous page which was interrupted, the script waits for the next one
+        if self.pending_script is not None and ok:
+            self.shell_loaded = True
+            script, self.pending_script = self.pending_script, None
+            self.web_view.page().runJavaScript(script, self.on_rendered)
+        elif ok:
+            self.on_rendered()
+
+    def on_rendered(self, result=None):
+        """Ends the latency spans of a navigation when its HTML is shown"""
+        self.latency.end("render")
+        if self.latency.end("navigate") is not None:
+            self.latency_label.setText(self.latency.summary("navigate"))
+            self.latency_label.setToolTip("\n".join(self.latency.summary(name) for name in self.latency.names()))
+
+    def on_render_mode_changed(self):
+        mode = self.render_box.currentData()
+        # HTML files are read and prepared on the loader threads, except for full page loads
+        self.loader.set_prepare_html(None if mode == "full" else partial(prepare, mode=mode))
+        if self.file_list and self.shown_index is not None:
+            # Only the HTML is shown again, the JSON tree and the annotation being edited stay
+            file_path = self.file_list[self.shown_index]
+            loaded = self.loader.get(file_path, *self.companions(file_path))
+            if not self.show_html(file_path, loaded.html):
+                self.on_rendered()
+            self.loader.prefetch(self.file_list, self.shown_index, self.companions)
+
+    def show_json(self, loaded):
+        """Replace the JSON tree, the old model releases its open file"""
+        if loaded.json_error is not None:
+            model = JsonTreeModel.from_error(loaded.json_error)
+        else:
+            model = JsonTreeModel(loaded.json)
+        # Streamed files are read through a file handle of every model, the old one can be closed afterwards
+        old_model = self.json_model
+        self.json_view.setModel(model)
+        self.json_model = model
+        old_model.close()
+        old_model.deleteLater()
+        if model.rowCount() <= EXPAND_ROWS:
+            self.json_view.expandToDepth(0)
 
     def save_annotation(self):
         """Save annotation in txt format"""
+        with self.latency.span("save", database=self.store is not None):
+            self.write_annotation()
+
+    def write_annotation(self):
+        """Writes the annotation to its txt file or to the database"""
         if self.file_list:
             current_file_path = self.file_list[self.current_index]
+            if self.store is not None:
+                self.autosave_timer.stop()
+                self.annotation_text.document().setModified(True)
+                self.autosave()
+                self.statusBar().showMessage(f"Annotation saved to {self.store.path}")
+                return
+
             file_name = os.path.basename(current_file_path)
             annotation_file = os.path.join(self.annotation_dir, f"{os.path.splitext(file_name)[0]}.txt")
 
             # Save the annotation to the specified file
+            text = self.annotation_text.toPlainText()
             with open(annotation_file, 'w', encoding='utf-8') as file:
-                file.write(self.annotation_text.toPlainText())
+                file.write(text)
+            self.loader.invalidate(current_file_path)
+            self.unannotated.mark(self.current_index, bool(text))
+            if self.corpus is not None:
+                self.corpus.update_annotation(annotation_file)
             self.statusBar().showMessage(f"Annotation saved to {annotation_file}")
 
+    def on_annotation_changed(self):
+        if self.store is not None:
+            self.autosave_timer.start()
+
+    def autosave(self, flush=True):
+        """Puts the edited annotation into the database, flush writes everything queued"""
+        if self.store is None:
+            return
+        if self.shown_index is not None and self.annotation_text.document().isModified():
+            file_path = self.file_list[self.shown_index]
+            text = self.annotation_text.toPlainText()
+            self.store.put(file_stem(file_path), text)
+            self.loader.invalidate(file_path)
+            self.unannotated.mark(self.shown_index, bool(text))
+            self.annotation_text.document().setModified(False)
+        if flush:
+            with self.latency.span("autosave"):
+                self.store.flush()
+
+    def open_store(self):
+        """Select a SQLite database used for annotations instead of the txt files"""
+        path, _ = QFileDialog.getSaveFileName(self, "Select Annotation Database", "",
+                                              "SQLite Databases (*.sqlite *.db);;All Files (*)",
+                                              options=QFileDialog.DontConfirmOverwrite)
+        if not path:
+            return
+        try:
+            store = AnnotationStore(path)
+        except Exception as e:
+            QMessageBox.warning(self, "Annotation Database", f"Cannot open {path}:\n{e}")
+            return
+        self.close_store()
+
+        # A new database can start with the annotations saved as txt files
+        if len(store) == 0 and self.annotation_dir and annotated_txt(self.annotation_dir):
+            answer = QMessageBox.question(self, "Annotation Database",
+                                          f"Import the txt annotations from {self.annotation_dir}?")
+            if answer == QMessageBox.Yes:
+                count = store.import_txt(self.annotation_dir)
+                self.statusBar().showMessage(f"Imported {count} annotations")
+
+        self.store = store
+        self.loader.set_store(store)
+        self.setWindowTitle(f"HTML and JSON Viewer - {os.path.basename(path)}")
+        self.update_unannotated()
+        if self.file_list:
+            self.shown_index = None
+            self.show_file(self.file_list[self.current_index])
+
+    def close_store(self):
+        if self.store is not None:
+            self.autosave_timer.stop()
+            self.autosave()
+            self.store.close()
+            self.store = None
+            self.loader.set_store(None)
+
+    def update_unannotated(self):
+        """Finds the files without annotation with one query or one directory listing"""
+        if self.store is not None:
+            annotated = self.store.names()
+        elif self.corpus is not None:
+            annotated = self.corpus.annotated()
+        else:
+            annotated = annotated_txt(self.annotation_dir)
+        self.unannotated = Unannotated([file_stem(file_path) for file_path in self.file_list], annotated)
+
+    def next_unannotated(self):
+        """Jump to the next file without annotation"""
+        if self.file_list:
+            # The current file may have been annotated just now
+            self.autosave()
+            index = self.unannotated.next(self.current_index)
+            if index is None:
+                self.statusBar().showMessage("All files are annotated")
+            else:
+                self.current_index = index
+                self.show_file(self.file_list[self.current_index])
+
+    def closeEvent(self, event):
+        self.close_store()
+        self.save_corpus()
+        self.latency.write()
+        super().closeEvent(event)
+
 
     def keyPressEvent(self, event):
         key = event.key()
@@ -158,29 +538,21 @@ class HTMLViewer(QMainWindow):
 
 
     def open_as_text(self):
-        # Show raw HTML code
+        # Show raw HTML code, the dialog is created once and reused
         if self.file_list:
-            current_file_path = self.file_list[self.current_index]
-            file_name = os.path.basename(current_file_path)
-
-            # Create a dialog to show the HTML file as plain text
-            text_dialog = QDialog(self)
-            text_dialog.setWindowTitle(f"Text View: {file_name}")
-            text_dialog.setGeometry(100, 100, 1024, 600)
-
-            # Create a QTextEdit widget inside the dialog
-            text_edit = QTextEdit(text_dialog)
-            text_edit.setGeometry(10, 10, 1014, 590)
-            text_edit.setReadOnly(True)
-
-            # Load the HTML file content as plain text
-            with open(current_file_path, 'r', encoding='utf-8') as file:
-                text_edit.setPlainText(file.read())
-
-            text_dialog.exec_()
+            if self.raw_dialog is None:
+                self.raw_dialog = RawHtmlDialog(self)
+            self.raw_dialog.open_file(self.file_list[self.current_index])
+            self.raw_dialog.show()
+            self.raw_dialog.raise_()
+            self.raw_dialog.activateWindow()
 
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
-    viewer = HTMLViewer()
+    parser = ArgumentParser(description="View HTML tables with their JSON and annotation files.")
+    parser.add_argument("--trace", default=os.environ.get(TRACE_ENV),
+                        help=f"measure latencies and write a Chrome trace to this file (or set {TRACE_ENV})")
+    options, qt_args = parser.parse_known_args()
+    app = QApplication(sys.argv[:1] + qt_args)
+    viewer = HTMLViewer(options.trace)
     viewer.show()
     sys.exit(app.exec_())
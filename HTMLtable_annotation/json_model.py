@@ -0,0 +1,205 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+import os
+import json
+from itertools import islice
+from PyQt5.QtCore import QAbstractItemModel, QModelIndex, Qt
+
+try:
+    # Optional, used to stream the top level of big files
+    import ijson
+except ImportError:
+    ijson = None
+
+
+# Rows added to an expanded node at once, more are fetched when the view scrolls down
+FETCH_BATCH = 500
+# Files larger than this are streamed if ijson is installed
+STREAM_THRESHOLD = 8 * 1024 * 1024
+# Length of the value column text of strings
+PREVIEW_LENGTH = 200
+
+
+class JsonStream:
+    """Top level items of a big JSON file, parsed only when they are shown"""
+    def __init__(self, path):
+        self.path = path
+        # The type of the top level container decides how items are read
+        with open(path, 'rb') as f:
+            head = f.read(4096).lstrip()
+        self.is_object = head[:1] == b"{"
+
+    def __iter__(self):
+        # Every iterator reads its own file handle, closing one (see JsonNode.finish) leaves the others working
+        with open(self.path, 'rb') as file:
+            if self.is_object:
+                yield from ijson.kvitems(file, "", use_float=True)
+            else:
+                yield from enumerate(ijson.items(file, "item", use_float=True))
+
+
+def load_json(path):
+    """Parsed content of a JSON file, or a JsonStream for big files when ijson is available"""
+    if ijson is not None and os.path.getsize(path) > STREAM_THRESHOLD:
+        return JsonStream(path)
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+class JsonNode:
+    """One key/value pair, children are created only when the node is expanded"""
+    __slots__ = ("key", "value", "parent", "row", "children", "pending")
+
+    def __init__(self, key, value, parent=None, row=0):
+        self.key = key
+        self.value = value
+        self.parent = parent
+        self.row = row
+        self.children = []
+        self.pending = None  # iterator over (key, value) pairs not turned into nodes yet
+
+    def is_container(self):
+        return isinstance(self.value, (dict, list, JsonStream))
+
+    def start(self):
+        if self.pending is None:
+            if isinstance(self.value, dict):
+                self.pending = iter(self.value.items())
+            elif isinstance(self.value, list):
+                self.pending = enumerate(self.value)
+            else:
+                self.pending = iter(self.value)
+
+    def can_fetch(self):
+        if not self.is_container():
+            return False
+        self.start()
+        if self.pending is not None and not isinstance(self.value, JsonStream):
+            # Sizes of parsed containers are known
+            return len(self.children) < len(self.value)
+        return self.pending is not None
+
+    def take(self, count):
+        """Next count (key, value) pairs which have no node yet"""
+        self.start()
+        items = []
+        try:
+            items.extend(islice(self.pending, count))
+        except Exception as e:
+            # Broken file found while streaming, the items read before the error are kept
+            items.append(("Error", f"Invalid JSON: {e}"))
+            self.finish()
+        if len(items) < count and isinstance(self.value, JsonStream):
+            self.finish()
+        return items
+
+    def add(self, items):
+        first = len(self.children)
+        self.children += [JsonNode(key, value, self, first + i) for i, (key, value) in enumerate(items)]
+
+    def finish(self):
+        if isinstance(self.value, JsonStream):
+            if self.pending is not None:
+                # Closes the file of the stream iterator
+                self.pending.close()
+            self.value = []
+        self.pending = iter(())
+
+    def preview(self):
+        value = self.value
+        if isinstance(value, dict):
+            return f"{{{len(value)}}}"
+        if isinstance(value, list):
+            return f"[{len(value)}]"
+        if isinstance(value, JsonStream):
+            return "{...}" if value.is_object else "[...]"
+        if isinstance(value, str):
+            return value if len(value) <= PREVIEW_LENGTH else value[:PREVIEW_LENGTH] + "..."
+        return json.dumps(value)
+
+
+class JsonTreeModel(QAbstractItemModel):
+    """
+    Tree model of a JSON document for QTreeView.
+    Nodes are created when their parent is expanded, in batches of FETCH_BATCH,
+    so only the rows the user looks at exist in memory.
+    """
+    def __init__(self, data=None, parent=None):
+        super().__init__(parent)
+        if data is None:
+            data = {}
+        elif not isinstance(data, (dict, list, JsonStream)):
+            # A document which is only a number, string or boolean is shown as one row
+            data = {"value": data}
+        self.root = JsonNode("", data)
+        # The first batch of top level rows exists before a view asks for it
+        self.root.add(self.root.take(FETCH_BATCH))
+
+    @classmethod
+    def from_error(cls, message):
+        return cls({"Error": message})
+
+    def close(self):
+        self.root.finish()
+
+    def node(self, index):
+        return index.internalPointer() if index.isValid() else self.root
+
+    def index(self, row, column, parent=QModelIndex()):
+        node = self.node(parent)
+        if 0 <= row < len(node.children) and 0 <= column < 2:
+            return self.createIndex(row, column, node.children[row])
+        return QModelIndex()
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        parent = index.internalPointer().parent
+        if parent is None or parent is self.root:
+            return QModelIndex()
+        return self.createIndex(parent.row, 0, parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return len(self.node(parent).children)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 2
+
+    def hasChildren(self, parent=QModelIndex()):
+        node = self.node(parent)
+        if node is self.root:
+            return True
+        if isinstance(node.value, (dict, list)):
+            return len(node.value) > 0
+        return isinstance(node.value, JsonStream)
+
+    def canFetchMore(self, parent):
+        return self.node(parent).can_fetch()
+
+    def fetchMore(self, parent):
+        node = self.node(parent)
+        # Streamed containers have no known size, read the items before announcing the rows
+        items = node.take(FETCH_BATCH)
+        if items:
+            start = len(node.children)
+            self.beginInsertRows(parent, start, start + len(items) - 1)
+            node.add(items)
+            self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+        node = index.internalPointer()
+        if index.column() == 0:
+            return str(node.key)
+        if role == Qt.ToolTipRole and isinstance(node.value, str):
+            return node.value[:10 * PREVIEW_LENGTH]
+        return node.preview()
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return ("Key", "Value")[section]
+        return None
@@ -0,0 +1,95 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+# Opt-in latency measurement of HTMLViewer.
+# Enable with the HTMLVIEWER_TRACE environment variable or the --trace option:
+#   HTMLVIEWER_TRACE=trace.json python html_viewer.py
+# Percentiles of the last navigations are shown in the status bar, the trace is written when the
+# viewer is closed (open it in chrome://tracing or ui.perfetto.dev).
+
+import os
+import json
+import threading
+from collections import deque
+from contextlib import contextmanager
+from time import perf_counter_ns
+
+
+TRACE_ENV = "HTMLVIEWER_TRACE"
+# Number of recent durations of every span the percentiles are calculated from
+WINDOW = 200
+PERCENTILES = (50, 90, 99)
+
+
+class LatencyRecorder:
+    """
+    Durations of named spans. Spans which start and end in different callbacks (e.g. a page load
+    ending in loadFinished) use begin() and end(), the others span(). Nothing is recorded unless
+    the recorder was created with a trace path.
+    """
+    def __init__(self, path=None):
+        self.enabled = bool(path)
+        self.path = path
+        self.events = []  # (name, start, end, thread id, args), times from perf_counter_ns
+        self.recent = {}  # name -> deque of the last WINDOW durations in ns
+        self.started = {}  # name -> (start, args) of spans waiting for end()
+
+    def record(self, name, start, end, **args):
+        if not self.enabled:
+            return
+        self.events.append((name, start, end, threading.get_ident(), args))
+        self.recent.setdefault(name, deque(maxlen=WINDOW)).append(end - start)
+
+    @contextmanager
+    def span(self, name, **args):
+        if not self.enabled:
+            yield
+            return
+        start = perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.record(name, start, perf_counter_ns(), **args)
+
+    def begin(self, name, **args):
+        """Starts a span, a span of the same name which did not end yet is dropped"""
+        if self.enabled:
+            self.started[name] = (perf_counter_ns(), args)
+
+    def end(self, name, **args):
+        """Ends a span started with begin(), returns its duration in ns or None if it was not started"""
+        if not self.enabled or name not in self.started:
+            return None
+        start, begin_args = self.started.pop(name)
+        end = perf_counter_ns()
+        self.record(name, start, end, **begin_args, **args)
+        return end - start
+
+    def percentiles(self, name):
+        """Nearest-rank PERCENTILES of the recent durations of name in ms, None if there are none"""
+        durations = sorted(self.recent.get(name, ()))
+        if not durations:
+            return None
+        return [durations[min(len(durations) - 1, -(-p * len(durations) // 100) - 1)] / 1e6 for p in PERCENTILES]
+
+    def summary(self, name):
+        values = self.percentiles(name)
+        if values is None:
+            return f"{name}: -"
+        text = ", ".join(f"p{p} {value:.1f} ms" for p, value in zip(PERCENTILES, values))
+        return f"{name}: {text} ({len(self.recent[name])})"
+
+    def names(self):
+        return sorted(self.recent)
+
+    def write(self, path=None):
+        """Writes the recorded spans as a Chrome trace"""
+        path = path or self.path
+        if not self.enabled or not path:
+            return
+        pid = os.getpid()
+        events = [{"name": name, "cat": "viewer", "ph": "X", "ts": start / 1000, "dur": (end - start) / 1000,
+                   "pid": pid, "tid": tid, "args": args}
+                  for name, start, end, tid, args in list(self.events)]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
@@ -0,0 +1,283 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+import os
+import mmap
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QPlainTextEdit, QLineEdit, QPushButton, QLabel, QScrollBar
+from PyQt5.QtGui import QSyntaxHighlighter, QTextCharFormat, QColor, QFont, QTextCursor
+from PyQt5.QtCore import Qt
+
+
+# Bytes of the file shown at once, the slider below the text moves between pages
+PAGE_BYTES = 64 * 1024
+# Page starts are moved back to a tag start found at most this many bytes before them
+ALIGN_BYTES = 4096
+# Longer lines are not highlighted, laying out their formats again would take longer than reading them
+HIGHLIGHT_LINE = 10000
+
+TAG_PATTERN = re.compile(rb"<(/?[A-Za-z][\w:.-]*)")
+# Searches for a tag like "<td" or "</table" use the tag index
+TAG_QUERY = re.compile(r"^<(/?[A-Za-z][\w:.-]*)$")
+
+
+def tag_offsets(buffer):
+    """Offsets of the tags in buffer, lower case tag name (with "/" for end tags) -> sorted array of int64"""
+    # An array keeps 8 bytes per offset, a list of ints about 36
+    offsets = {}
+    for match in TAG_PATTERN.finditer(buffer):
+        name = match.group(1).decode('ascii').lower()
+        positions = offsets.get(name)
+        if positions is None:
+            positions = offsets[name] = array('q')
+        positions.append(match.start())
+    return offsets
+
+
+def file_tag_offsets(path):
+    """tag_offsets of a file, read through its own mapping so the shown one can be closed meanwhile"""
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        return tag_offsets(buffer)
+
+
+def text_length(data):
+    """Length of decoded bytes in the units QPlainTextEdit positions use (UTF-16, \\r\\n as one)"""
+    text = data.decode('utf-8', errors='replace').replace("\r\n", "\n")
+    return len(text.encode('utf-16-le')) // 2
+
+
+class HtmlHighlighter(QSyntaxHighlighter):
+    """Colours tags, attributes, quoted values, entities and comments in one pass over each line"""
+    PATTERN = re.compile(r"(?P<comment><!--.*?(?:-->|$))|(?P<tag></?[A-Za-z][^\s>/]*|/?>)"
+                         r"|(?P<attribute>(?<=\s)[\w:.-]+(?==))|(?P<string>\"[^\"]*\"|'[^']*')|(?P<entity>&#?\w+;)")
+    COMMENT_END = re.compile(r"-->")
+    COLORS = {"comment": ("#808080", False), "tag": ("#1f4fb5", True), "attribute": ("#a0522d", False),
+              "string": ("#2e7d32", False), "entity": ("#8e24aa", False)}
+
+    def __init__(self, document):
+        super().__init__(document)
+        self.blocks = set()  # Numbers of the blocks which are highlighted, the others are skipped
+        self.formats = {}
+        for name, (color, bold) in self.COLORS.items():
+            text_format = QTextCharFormat()
+            text_format.setForeground(QColor(color))
+            if bold:
+                text_format.setFontWeight(QFont.Bold)
+            self.formats[name] = text_format
+
+    def highlight_blocks(self, first, last):
+        """Highlights blocks first to last which were not highlighted yet"""
+        new = set(range(first, last + 1)) - self.blocks
+        self.blocks |= new
+        document = self.document()
+        for number in sorted(new):
+            block = document.findBlockByNumber(number)
+            if block.length() <= HIGHLIGHT_LINE:
+                self.rehighlightBlock(block)
+
+    def highlightBlock(self, text):
+        if self.currentBlock().blockNumber() not in self.blocks or len(text) > HIGHLIGHT_LINE:
+            return
+        # Qt positions count UTF-16 units, characters outside the BMP take two of them
+        wide = [i for i, char in enumerate(text) if char > "\uffff"] if not text.isascii() else []
+
+        def position(i):
+            return i + bisect_left(wide, i) if wide else i
+
+        # Comments can continue over several lines, block state 1 means an open comment
+        self.setCurrentBlockState(0)
+        start = 0
+        if self.previousBlockState() == 1:
+            end = self.COMMENT_END.search(text)
+            start = end.end() if end else len(text)
+            self.setFormat(0, position(start), self.formats["comment"])
+            if end is None:
+                self.setCurrentBlockState(1)
+                return
+        for match in self.PATTERN.finditer(text, start):
+            kind = match.lastgroup
+            if kind == "comment" and not match.group().endswith("-->"):
+                self.setCurrentBlockState(1)
+            begin = position(match.start())
+            self.setFormat(begin, position(match.end()) - begin, self.formats[kind])
+
+
+class RawHtmlDialog(QDialog):
+    """
+    Raw text of an HTML file, one page of PAGE_BYTES at a time.
+    The file is memory mapped, only the shown page is decoded and highlighted.
+    The dialog is kept and reused for the next file.
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setGeometry(100, 100, 1024, 600)
+        self.file = None
+        self.buffer = None  # mmap of the file, None for empty files
+        self.size = 0
+        self.page_start = self.page_end = 0
+        self.last_match = None  # (query, offset) of the last search result
+        self.tags = None  # Tag index, built in the background
+        self.generation = 0  # Number of opened files, results for an older file are dropped
+
+        layout = QVBoxLayout(self)
+        search_layout = QHBoxLayout()
+        layout.addLayout(search_layout)
+        self.search_edit = QLineEdit(self)
+        self.search_edit.setPlaceholderText("Find text, or a tag like <td")
+        self.search_edit.returnPressed.connect(self.find_next)
+        search_layout.addWidget(self.search_edit)
+        self.find_button = QPushButton("Find Next", self)
+        self.find_button.clicked.connect(self.find_next)
+        search_layout.addWidget(self.find_button)
+        self.position_label = QLabel("", self)
+        search_layout.addWidget(self.position_label)
+
+        self.text_edit = QPlainTextEdit(self)
+        self.text_edit.setReadOnly(True)
+        self.highlighter = HtmlHighlighter(self.text_edit.document())
+        # Lines are highlighted when they are scrolled into view
+        self.text_edit.verticalScrollBar().valueChanged.connect(self.highlight_visible)
+        layout.addWidget(self.text_edit)
+
+        self.page_bar = QScrollBar(Qt.Horizontal, self)
+        self.page_bar.valueChanged.connect(self.show_page)
+        layout.addWidget(self.page_bar)
+
+    def open_file(self, path):
+        self.release()
+        self.setWindowTitle(f"Text View: {os.path.basename(path)}")
+        self.file = open(path, 'rb')
+        self.size = self.file.seek(0, 2)
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+        self.last_match = None
+        # Searches for tags are exact lookups once the index is ready
+        self.generation += 1
+        if self.buffer is not None:
+            threading.Thread(target=self.build_tag_index, args=(path, self.generation), daemon=True).start()
+
+        pages = max(1, -(-self.size // PAGE_BYTES))
+        self.page_bar.blockSignals(True)
+        self.page_bar.setRange(0, pages - 1)
+        self.page_bar.setValue(0)
+        self.page_bar.blockSignals(False)
+        self.page_bar.setVisible(pages > 1)
+        self.show_page(0)
+
+    def build_tag_index(self, path, generation):
+        try:
+            tags = file_tag_offsets(path)
+        except (OSError, ValueError):
+            return  # Searches use mmap.find
+        if generation == self.generation:
+            self.tags = tags
+
+    def release(self):
+        """Closes the mapped file, open mappings would keep it locked on Windows"""
+        self.tags = None
+        self.generation += 1
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.size = 0
+
+    def closeEvent(self, event):
+        self.release()
+        super().closeEvent(event)
+
+    def reject(self):
+        self.release()
+        super().reject()
+
+    def align(self, offset):
+        """Offset moved back to a tag start or at least to the start of a UTF-8 character"""
+        if offset <= 0 or offset >= self.size:
+            return min(max(offset, 0), self.size)
+        tag = self.buffer.rfind(b"<", max(0, offset - ALIGN_BYTES), offset + 1)
+        if tag > 0:
+            return tag
+        while offset > 0 and 0x80 <= self.buffer[offset] < 0xC0:
+            offset -= 1
+        return offset
+
+    def page_range(self, page):
+        return self.align(page * PAGE_BYTES), self.align((page + 1) * PAGE_BYTES)
+
+    def show_page(self, page):
+        if self.buffer is None:
+            self.page_start = self.page_end = 0
+            self.text_edit.setPlainText("")
+            self.position_label.setText("Empty file")
+            return
+        self.page_start, self.page_end = self.page_range(page)
+        self.highlighter.blocks.clear()
+        self.text_edit.setPlainText(self.buffer[self.page_start:self.page_end].decode('utf-8', errors='replace'))
+        self.highlight_visible()
+        self.position_label.setText(f"Bytes {self.page_start:,}-{self.page_end:,} of {self.size:,}")
+
+    def highlight_visible(self):
+        block = self.text_edit.firstVisibleBlock()
+        first = last = block.blockNumber()
+        offset = self.text_edit.contentOffset()
+        height = self.text_edit.viewport().height()
+        while block.isValid() and self.text_edit.blockBoundingGeometry(block).translated(offset).top() <= height:
+            last = block.blockNumber()
+            block = block.next()
+        self.highlighter.highlight_blocks(first, last)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.highlight_visible()
+
+    def find_next(self):
+        """Finds the search text after the last result, or from the shown page"""
+        query = self.search_edit.text()
+        if not query or self.buffer is None:
+            return
+        if self.last_match is not None and self.last_match[0] == query and self.page_start <= self.last_match[1] < self.page_end:
+            start = self.last_match[1] + 1
+        else:
+            start = self.page_start
+        offset, length = self.find(query, start)
+        wrapped = False
+        if offset < 0 and start > 0:
+            offset, length = self.find(query, 0)
+            wrapped = True
+        if offset < 0:
+            self.position_label.setText(f"{query} not found")
+            return
+        self.last_match = (query, offset)
+        self.select(offset, length)
+        if wrapped:
+            self.position_label.setText(self.position_label.text() + ", search wrapped")
+
+    def find(self, query, start):
+        """Offset and byte length of the first match at or after start, offset -1 if there is none"""
+        tag = TAG_QUERY.match(query)
+        tags = self.tags
+        if tag is not None and tags is not None:
+            offsets = tags.get(tag.group(1).lower(), ())
+            i = bisect_left(offsets, start)
+            return (offsets[i] if i < len(offsets) else -1), len(query)
+        data = query.encode('utf-8')
+        return self.buffer.find(data, start), len(data)
+
+    def select(self, offset, length):
+        page = offset // PAGE_BYTES
+        if offset >= self.page_range(page)[1]:
+            page += 1  # The next page starts earlier because of the alignment
+        if not self.page_start <= offset < self.page_end:
+            self.page_bar.setValue(page)
+        position = text_length(self.buffer[self.page_start:offset])
+        end = position + text_length(self.buffer[offset:min(offset + length, self.page_end)])
+        cursor = self.text_edit.textCursor()
+        cursor.setPosition(position)
+        cursor.setPosition(end, QTextCursor.KeepAnchor)
+        self.text_edit.setTextCursor(cursor)
+        self.text_edit.centerCursor()
+        self.position_label.setText(f"Byte {offset:,} of {self.size:,}")
@@ -0,0 +1,77 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+import os
+import sqlite3
+
+import annotation_store
+from annotation_store import AnnotationStore, Unannotated, annotated_txt
+
+
+def stored_rows(path):
+    connection = sqlite3.connect(path)
+    try:
+        return dict(connection.execute("SELECT name, text FROM annotations"))
+    finally:
+        connection.close()
+
+
+def test_annotations_are_written_in_batches(tmp_path):
+    path = str(tmp_path / "annotations.sqlite")
+    store = AnnotationStore(path, batch_size=3)
+    store.put("a", "first")
+    store.put("b", "")
+    # Queued annotations are read back before they are written
+    assert store.get("a") == "first"
+    assert store.get("missing") is None
+    assert stored_rows(path) == {}
+    store.put("c", "third")
+    assert stored_rows(path) == {"a": "first", "b": "", "c": "third"}
+
+    store.put("a", "changed")
+    assert store.names() == {"a", "c"}
+    assert len(store) == 3
+    store.close()
+    assert stored_rows(path)["a"] == "changed"
+
+
+def test_reopened_store_keeps_annotations(tmp_path):
+    path = str(tmp_path / "annotations.sqlite")
+    store = AnnotationStore(path)
+    store.put("table 1", "text with\nnew lines")
+    store.close()
+    store = AnnotationStore(path)
+    assert store.get("table 1") == "text with\nnew lines"
+    store.close()
+
+
+def test_import_and_export_of_txt_files(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "a.txt").write_text("done", encoding='utf-8')
+    (source / "b.txt").write_text("", encoding='utf-8')
+    (source / "notes.md").write_text("not an annotation", encoding='utf-8')
+    assert annotated_txt(str(source)) == {"a"}
+    assert annotated_txt("") == set()
+
+    database = str(tmp_path / "annotations.sqlite")
+    assert annotation_store.main(["import", database, str(source)]) == 0
+    assert stored_rows(database) == {"a": "done", "b": ""}
+    target = tmp_path / "target"
+    assert annotation_store.main(["export", database, str(target)]) == 0
+    assert sorted(os.listdir(target)) == ["a.txt", "b.txt"]
+    assert (target / "a.txt").read_text(encoding='utf-8') == "done"
+
+
+def test_unannotated_positions():
+    unannotated = Unannotated(["a", "b", "c", "d"], {"a", "c"})
+    assert len(unannotated) == 2
+    assert unannotated.next(0) == 1
+    assert unannotated.next(1) == 3
+    assert unannotated.next(3) == 1  # Wraps around
+    unannotated.mark(1, True)
+    unannotated.mark(2, False)
+    assert unannotated.positions == [2, 3]
+    unannotated.mark(2, True)
+    unannotated.mark(3, True)
+    assert unannotated.next(0) is None
@@ -0,0 +1,97 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+import os
+import pytest
+
+from corpus_index import CorpusIndex
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    """Three HTML files, two with JSON, one with an annotation and one with an empty annotation"""
+    directories = {}
+    for kind in ("html", "json", "ann"):
+        directories[kind] = tmp_path / kind
+        directories[kind].mkdir()
+    for stem in ("a", "b", "c"):
+        (directories["html"] / f"{stem}.html").write_text(f"<table><tr><td>{stem}</td></tr></table>" * (ord(stem) - 96))
+    for stem in ("a", "c"):
+        (directories["json"] / f"{stem}.json").write_text("{}")
+    (directories["ann"] / "a.txt").write_text("done")
+    (directories["ann"] / "b.txt").write_text("")
+    (directories["html"] / "notes.txt").write_text("not an HTML file")
+    return {kind: str(path) for kind, path in directories.items()}
+
+
+def open_index(corpus, index_path=False):
+    return CorpusIndex.open(corpus["html"], corpus["json"], corpus["ann"], index_path=index_path)
+
+
+def test_files_are_paired_by_name(corpus):
+    index = open_index(corpus)
+    entries = {entry.stem: entry for entry in index.select()}
+    assert sorted(entries) == ["a", "b", "c"]
+    assert entries["a"].json == os.path.join(corpus["json"], "a.json")
+    assert entries["a"].annotation == os.path.join(corpus["ann"], "a.txt")
+    # An empty annotation file does not count
+    assert entries["b"].json is None and entries["b"].annotation is None
+    assert index.entry("c") == entries["c"]
+    assert index.entry("notes") is None
+    assert index.counts() == {"files": 3, "annotated": 1, "missing_json": 1}
+
+
+def test_select_filters_and_sorts(corpus):
+    index = open_index(corpus)
+    assert [e.stem for e in index.select("unannotated")] == ["b", "c"]
+    assert [e.stem for e in index.select("annotated")] == ["a"]
+    assert [e.stem for e in index.select("missing_json")] == ["b"]
+    assert [e.stem for e in index.select("all", "size")] == ["a", "b", "c"]
+    # Names from an annotation database replace the annotation files
+    assert [e.stem for e in index.select("unannotated", annotated={"c"})] == ["a", "b"]
+    # The file being annotated stays in the list
+    assert [e.stem for e in index.select("unannotated", keep=["a"])] == ["a", "b", "c"]
+
+
+def test_refresh_finds_new_and_changed_files(corpus):
+    index = open_index(corpus)
+    assert not index.refresh(corpus["ann"])
+
+    # Written in place, the directory does not change
+    path = os.path.join(corpus["ann"], "b.txt")
+    with open(path, 'w') as f:
+        f.write("done too")
+    os.utime(path, (1, 1))
+    assert index.refresh(corpus["ann"])
+    assert [e.stem for e in index.select("annotated")] == ["a", "b"]
+
+    with open(os.path.join(corpus["html"], "d.html"), 'w') as f:
+        f.write("<table></table>")
+    os.utime(corpus["html"], ns=(0, 0))
+    assert index.refresh(corpus["html"])
+    assert index.entry("d") is not None
+
+
+def test_persisted_index_is_checked_against_the_files(corpus, tmp_path):
+    index_path = str(tmp_path / "index.json")
+    open_index(corpus, index_path)
+    assert os.path.exists(index_path)
+
+    path = os.path.join(corpus["ann"], "a.txt")
+    with open(path, 'w') as f:
+        f.write("")
+    os.utime(path, (1, 1))
+    index = open_index(corpus, index_path)
+    assert index.path == index_path
+    assert [e.stem for e in index.select("annotated")] == []
+
+
+def test_loader_reads_the_paths_of_the_entry(corpus):
+    pytest.importorskip("PyQt5.QtCore")
+    from file_loader import read_files
+    index = open_index(corpus)
+    loaded = read_files(index.entry("a").html, index.entry("a").json, index.entry("a").annotation)
+    assert (loaded.json, loaded.json_error, loaded.annotation) == ({}, None, "done")
+    entry = index.entry("b")
+    loaded = read_files(entry.html, entry.json, entry.annotation)
+    assert (loaded.json, loaded.annotation) == (None, None)
@@ -0,0 +1,80 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+import json
+import pytest
+
+import export_corpus
+from annotation_store import AnnotationStore
+from corpus_index import CorpusIndex
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    """Four tables: valid JSON and annotation, invalid JSON, no JSON, and an unreadable HTML file"""
+    directories = {kind: tmp_path / kind for kind in ("html", "json", "ann")}
+    for directory in directories.values():
+        directory.mkdir()
+    for stem in ("a", "b", "c"):
+        (directories["html"] / f"{stem}.html").write_text(f"<table><tr><td>{stem}</td></tr></table>", encoding='utf-8')
+    (directories["html"] / "d.html").write_bytes(b"<table>\xff</table>")
+    (directories["json"] / "a.json").write_text('{"rows": [1, 2]}', encoding='utf-8')
+    (directories["json"] / "b.json").write_text('{"rows": ', encoding='utf-8')
+    (directories["json"] / "d.json").write_text('[]', encoding='utf-8')
+    (directories["ann"] / "a.txt").write_text("done", encoding='utf-8')
+    return {kind: str(path) for kind, path in directories.items()}
+
+
+def arguments(corpus, *options):
+    return [corpus["html"], "--json-dir", corpus["json"], "--annotation-dir", corpus["ann"], *options]
+
+
+def test_validation_reports_every_file(corpus, tmp_path):
+    report = tmp_path / "report.csv"
+    assert export_corpus.main(arguments(corpus, "--report", str(report))) == 1
+    lines = report.read_text(encoding='utf-8').splitlines()
+    assert lines[0] == "Name;JSON;Annotation;Error"
+    states = {line.split(";")[0]: line.split(";")[1:3] for line in lines[1:]}
+    assert states == {"a": ["ok", "ok"], "b": ["invalid", "missing"], "c": ["missing", "missing"],
+                      "d": ["ok", "missing"]}
+
+
+def test_jsonl_export_keeps_the_order_and_content(corpus, tmp_path):
+    output = tmp_path / "dataset.jsonl"
+    assert export_corpus.main(arguments(corpus, "-o", str(output), "-j", "3")) == 1
+    records = [json.loads(line) for line in output.read_text(encoding='utf-8').splitlines()]
+    assert [record["name"] for record in records] == ["a", "b", "c", "d"]
+    assert records[0]["json"] == {"rows": [1, 2]}
+    assert records[0]["annotation"] == "done"
+    assert records[0]["html"] == "<table><tr><td>a</td></tr></table>"
+    assert records[1]["json"] is None and records[1]["json_error"].startswith("JSONDecodeError")
+    assert records[3]["html"] is None and records[3]["error"].startswith("UnicodeDecodeError")
+
+
+def test_export_reads_annotations_from_a_store(corpus, tmp_path):
+    store = AnnotationStore(str(tmp_path / "annotations.sqlite"))
+    store.put("c", "from the store")
+    store.flush()
+    index = CorpusIndex.open(corpus["html"], corpus["json"], corpus["ann"], index_path=False)
+    entries = index.select("annotated", annotated=store.names())
+    writer_records = []
+
+    class Writer:
+        def write(self, records):
+            writer_records.extend(records)
+
+    summary = export_corpus.export(entries, Writer(), store, workers=2)
+    store.close()
+    assert [(r.name, r.annotation) for r in writer_records] == [("c", "from the store")]
+    # The summary keeps only the state of the files
+    assert summary[0].html is None and summary[0].annotation == ""
+
+
+def test_parquet_export(corpus, tmp_path):
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+    output = tmp_path / "dataset.parquet"
+    export_corpus.main(arguments(corpus, "-o", str(output), "--status", "annotated"))
+    table = pyarrow.parquet.read_table(str(output)).to_pylist()
+    assert [row["name"] for row in table] == ["a"]
+    assert json.loads(table[0]["json"]) == {"rows": [1, 2]}
@@ -0,0 +1,68 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+import pytest
+
+pytest.importorskip("PyQt5.QtCore")
+from html_render import HtmlTableModel, PageContent, TableContent, parse_table, prepare, prepare_page
+
+
+def test_colspan_keeps_following_cells_in_their_column():
+    table = parse_table("<table><tr><td colspan=3>a</td><td>b</td></tr>"
+                        "<tr><td>1</td><td colspan='x'>2</td><td colspan=0>3</td><td>4</td></tr></table>")
+    assert table == TableContent([["a", "", "", "b"], ["1", "2", "3", "4"]])
+
+
+def test_header_is_a_first_row_of_th_cells():
+    html = "<table><tr><th>A</th><th colspan=2>B</th></tr><tr><td>1</td><td>2</td><td>3</td></tr></table>"
+    assert parse_table(html) == TableContent([["1", "2", "3"]], ["A", "B", ""])
+    # A <td> in the first row, a <th> only table and a single row are not headers
+    assert parse_table("<table><tr><th>A</th><td>B</td></tr><tr><td>1</td><td>2</td></tr></table>").header is None
+    assert parse_table("<table><tr><th>A</th></tr></table>") == TableContent([["A"]])
+    assert parse_table("<table><tr><td>1</td></tr><tr><th>A</th></tr></table>").header is None
+
+
+def test_nested_table_is_text_of_its_cell():
+    html = ("<table><tr><td>1<br>2</td><td>t<table><tr><td>in</td><td>ner</td></tr></table></td><td>z</td></tr>"
+            "<tr><td><p>x</p><div>y</div></td></tr></table>")
+    assert parse_table(html) == TableContent([["1 2", "t in ner", "z"], ["x y"]])
+
+
+def test_cells_without_rows_and_unclosed_cells():
+    assert parse_table("<table><td> a\n b </td><td>c") == TableContent([["a b", "c"]])
+    assert parse_table("<p>no table</p>") is None
+    assert parse_table("<table><tr></tr></table>") is None
+
+
+def test_table_model_fills_short_rows():
+    model = HtmlTableModel(TableContent([["1", "2", "3"], ["4"]], ["A", "B"]))
+    assert (model.rowCount(), model.columnCount()) == (2, 3)
+    assert model.data(model.index(1, 2)) == ""
+    assert model.headerData(1, 1) == "B"
+
+
+def test_prepare_page_body_and_styles():
+    html = "<html><head><style>td{color:red}</style></head><BODY class='x'><table></table></BODY></html>"
+    assert prepare_page(html) == PageContent("<table></table>", "td{color:red}", True)
+    # A fragment keeps its content, its styles are passed separately
+    fragment = "<style>p{margin:0}</style><p>a</p><style>td{color:red}</style>"
+    assert prepare_page(fragment) == PageContent("<p>a</p>", "p{margin:0}\ntd{color:red}", True)
+
+
+@pytest.mark.parametrize("head", ["<script src='a.js'></script>", "<SCRIPT>1</SCRIPT>",
+                                  "<link rel='stylesheet' href='a.css'>", "<LINK href='a.css' rel=stylesheet>",
+                                  "<base href='http://example.com/'>", "<iframe src='a.html'></iframe>",
+                                  "<frame src='a.html'>"])
+def test_pages_needing_a_full_load_are_not_simple(head):
+    assert not prepare_page(f"<html><head>{head}</head><body><p>a</p></body></html>").simple
+
+
+def test_other_links_do_not_need_a_full_load():
+    assert prepare_page("<html><head><link rel='icon' href='a.ico'></head><body>a</body></html>").simple
+
+
+def test_prepare_by_mode():
+    html = "<body><table><tr><td>1</td></tr></table></body>"
+    assert prepare(html, "full") is None
+    assert prepare(html, "swap").body == "<table><tr><td>1</td></tr></table>"
+    assert prepare(html, "table") == TableContent([["1"]])
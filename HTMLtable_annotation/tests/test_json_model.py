@@ -0,0 +1,74 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+import json
+import pytest
+
+pytest.importorskip("PyQt5.QtCore")
+import json_model
+from json_model import FETCH_BATCH, JsonStream, JsonTreeModel, load_json
+
+
+def keys(model):
+    return [model.data(model.index(row, 0)) for row in range(model.rowCount())]
+
+
+def fetch_all(model):
+    root = model.index(-1, -1)
+    while model.canFetchMore(root):
+        model.fetchMore(root)
+
+
+@pytest.fixture
+def big_list(tmp_path, monkeypatch):
+    pytest.importorskip("ijson")
+    monkeypatch.setattr(json_model, "STREAM_THRESHOLD", 0)
+    path = tmp_path / "big.json"
+    path.write_text(json.dumps([{"row": i} for i in range(FETCH_BATCH + 20)]), encoding='utf-8')
+    return str(path)
+
+
+def test_parsed_document_is_fetched_in_batches():
+    model = JsonTreeModel({f"k{i}": i for i in range(FETCH_BATCH * 2 + 1)})
+    assert model.rowCount() == FETCH_BATCH
+    fetch_all(model)
+    assert model.rowCount() == FETCH_BATCH * 2 + 1
+    assert model.data(model.index(3, 1)) == "3"
+
+
+@pytest.mark.parametrize("data", [5, 2.5, True, False, "abc", ""])
+def test_scalar_document_is_one_row(data):
+    model = JsonTreeModel(data)
+    assert keys(model) == ["value"]
+    assert model.data(model.index(0, 1)) == (data if isinstance(data, str) else json.dumps(data))
+    assert not model.hasChildren(model.index(0, 0))
+
+
+def test_stream_is_read_in_batches(big_list):
+    data = load_json(big_list)
+    assert isinstance(data, JsonStream)
+    model = JsonTreeModel(data)
+    assert model.rowCount() == FETCH_BATCH
+    fetch_all(model)
+    assert keys(model) == [str(i) for i in range(FETCH_BATCH + 20)]
+    assert model.data(model.index(0, 1)) == "{1}"
+
+
+def test_closing_old_model_keeps_new_model_of_same_stream(big_list):
+    # The loader cache hands the same JsonStream to every model of the file
+    data = load_json(big_list)
+    old = JsonTreeModel(data)
+    new = JsonTreeModel(data)
+    old.close()
+    fetch_all(new)
+    assert new.rowCount() == FETCH_BATCH + 20
+
+
+def test_broken_stream_keeps_items_read_before_the_error(tmp_path, monkeypatch):
+    pytest.importorskip("ijson")
+    monkeypatch.setattr(json_model, "STREAM_THRESHOLD", 0)
+    path = tmp_path / "broken.json"
+    path.write_text('{"a": 1, "b": [2, 3], "c": ', encoding='utf-8')
+    model = JsonTreeModel(load_json(str(path)))
+    assert keys(model) == ["a", "b", "Error"]
+    assert not model.canFetchMore(model.index(-1, -1))
@@ -0,0 +1,48 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+import json
+
+import latency
+from latency import LatencyRecorder
+
+
+def test_disabled_recorder_records_nothing(tmp_path):
+    recorder = LatencyRecorder()
+    with recorder.span("read"):
+        pass
+    recorder.begin("navigate")
+    assert recorder.end("navigate") is None
+    assert recorder.names() == [] and recorder.events == []
+    recorder.write(str(tmp_path / "trace.json"))
+    assert not (tmp_path / "trace.json").exists()
+
+
+def test_percentiles_of_recent_durations(monkeypatch):
+    monkeypatch.setattr(latency, "WINDOW", 10)
+    recorder = LatencyRecorder("trace.json")
+    for ms in range(1, 21):
+        recorder.record("navigate", 0, ms * 1_000_000)
+    # Only the last WINDOW durations (11-20 ms) count, nearest rank
+    assert recorder.percentiles("navigate") == [15.0, 19.0, 20.0]
+    assert recorder.summary("navigate") == "navigate: p50 15.0 ms, p90 19.0 ms, p99 20.0 ms (10)"
+    assert recorder.percentiles("render") is None
+    assert recorder.summary("render") == "render: -"
+
+
+def test_spans_are_written_as_chrome_trace(tmp_path):
+    path = tmp_path / "trace.json"
+    recorder = LatencyRecorder(str(path))
+    with recorder.span("read_json", file="a.json"):
+        pass
+    recorder.begin("navigate", file="a.html")
+    recorder.begin("navigate", file="b.html")  # Replaces the span which did not end
+    assert recorder.end("navigate", mode="table") >= 0
+    assert recorder.end("navigate") is None
+    assert recorder.names() == ["navigate", "read_json"]
+
+    recorder.write()
+    events = json.loads(path.read_text(encoding='utf-8'))["traceEvents"]
+    assert [(e["name"], e["ph"], e["args"]) for e in events] == [
+        ("read_json", "X", {"file": "a.json"}), ("navigate", "X", {"file": "b.html", "mode": "table"})]
+    assert all(e["dur"] >= 0 for e in events)
@@ -0,0 +1,27 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+import pytest
+from bisect import bisect_left
+
+pytest.importorskip("PyQt5.QtWidgets")
+from raw_viewer import file_tag_offsets, tag_offsets
+
+
+def test_tag_offsets_are_sorted_int64_arrays():
+    buffer = b"<html><TABLE><tr><td>1</td><td>2</td></tr></table></html>"
+    tags = tag_offsets(buffer)
+    assert {name: list(offsets) for name, offsets in tags.items()} == {
+        "html": [0], "table": [6], "tr": [13], "td": [17, 27], "/td": [22, 32], "/tr": [37], "/table": [42],
+        "/html": [50]}
+    assert all(offsets.typecode == 'q' for offsets in tags.values())
+    # The search of the raw viewer bisects them like lists
+    assert tags["td"][bisect_left(tags["td"], 18)] == 27
+
+
+def test_file_tag_offsets(tmp_path):
+    path = tmp_path / "page.html"
+    path.write_bytes(b"<p>a</p>\n" * 1000)
+    tags = file_tag_offsets(str(path))
+    assert list(tags["p"]) == list(range(0, 9000, 9))
+    assert list(tags["/p"]) == list(range(4, 9000, 9))
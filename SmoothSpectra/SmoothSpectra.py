@@ -1,89 +1,70 @@
 __author__ = "Tomasz Galica"
 __license__ = "GNU"
 
+from collections import OrderedDict
 from sys import argv, exit
-from numpy import abs, argmax, genfromtxt, array, where
+from threading import Thread
+from time import perf_counter_ns
+
+# Start of the script, the window start-up time is measured from here
+STARTED = perf_counter_ns()
+
+if __name__ == '__main__' and len(argv) > 1 and argv[1] == 'batch':
+    # Headless processing, PyQt5 and matplotlib are not loaded, see batch.py
+    from batch import main
+    exit(main(argv[2:]))
+
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout,
     QPushButton, QLabel, QLineEdit, QFileDialog, QSpinBox, QCheckBox
 )
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QTimer, pyqtSignal
 
-from scipy.signal import savgol_filter
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas, NavigationToolbar2QT
 from matplotlib.figure import Figure
 from matplotlib.backend_bases import MouseButton
-from scipy.signal import find_peaks
+from spectra_cache import SpectrumCache, load_spectrum
+from spectra_io import write_curve, write_curve_npz
+import profiling
+import spectra_core
 
 
 
 #TODO:
 # 1) Make the script only need to pick up the background file and automatically pair it with signal file.
 
-def is_number(element: any) -> bool:
-    #If you expect None to be passed:
-    if element is None: 
-        return False
-    try:
-        float(element)
-        return True
-    except ValueError:
-        try:
-            int(element)
-            return True
-        except ValueError:
-            return False
+# Delay after the last change of the window before live smoothing starts
+SMOOTH_DEBOUNCE_MS = 250
+# Number of smoothed curves kept for quick switching between windows
+SMOOTH_CACHE_SIZE = 16
+# Minimal number of bins of the min/max summary used for plotting
+LOD_MIN_BINS = 200
+# File types offered when saving curves
+SAVE_FILTER = "Text Files (*.txt);;NumPy archive (*.npz);;All Files (*)"
 
 
-def process_data(path):
-    """
-    This function performs initial preprocessing of a txt file into NumPy arrays.
-    Parameters: 
-    - path: Path to the file with data
-    
-    Returns: 
-    - wavelength: NumPy array of the first column (index)
-    - value: NumPy array of the last column (data)
-    """
-    with open(path, 'r', encoding='utf-8') as f:
-        data = f.readlines()
-
-    # Detect the most frequent number of columns (width)
-    detect_cols_n = {}
-    for line in data:
-        cols_count = len(line.split(";"))
-        detect_cols_n[cols_count] = detect_cols_n.get(cols_count, 0) + 1
-    
-    # Determine the width by the most frequent number of columns
-    width = max(detect_cols_n, key=detect_cols_n.get)
-    
-    if width == 1:
-        # If width is 1, skip first 7 rows and load the data directly
-        raw_data = genfromtxt(path, delimiter=";", skip_header=7)
-    else:
-        # Process the lines with the detected width
-        processed_lines = [line.replace(",", ".").split(";") for line in data if len(line.split(";")) == width]
-        processed_lines = array(processed_lines)
-
-        # Find the row where numerical data starts
-        num_start = 0
-        for i, line in enumerate(processed_lines):
-            if all([is_number(val) for val in line]):
-                num_start = i
-                break
-
-        # Merge headers if they exist
-        headers = [''] * width
-        for i in range(num_start):
-            headers = [" ".join(filter(None, [h.strip(), line.strip()])) for h, line in zip(headers, processed_lines[i])]
-        
-        # Extract the data rows starting from the first row with numerical values
-        raw_data = processed_lines[num_start:].astype(float)
-    
-    # Assume first column is wavelength and last one is value
-    wavelength = raw_data[:, 0]  # First column
-    rvalue = raw_data[:, -1]  # Last column
+class SmoothSignals(QObject):
+    # data version, job number, window, smoothed values (None if smoothing failed)
+    finished = pyqtSignal(int, int, int, object)
 
-    return ((headers[0],wavelength), (headers[-1],rvalue))
+
+class SmoothJob(QRunnable):
+    """Runs the Savitzky-Golay filter outside of the GUI thread."""
+    def __init__(self, signals, data_id, job, values, window):
+        super().__init__()
+        self.signals = signals
+        self.data_id = data_id
+        self.job = job
+        self.values = values
+        self.window = window
+
+    def run(self):
+        try:
+            smoothed_values = spectra_core.smooth(self.values, self.window)
+        except ValueError:
+            # e.g. window longer than the curve
+            smoothed_values = None
+        self.signals.finished.emit(self.data_id, self.job, self.window, smoothed_values)
 
 
 class App(QWidget):
@@ -135,6 +116,24 @@ class App(QWidget):
         self.sawgol_window.setMaximum(500)
         btn_layout.addWidget(self.sawgol_window)
 
+        # Live smoothing while the window is changed
+        self.live_smooth = QCheckBox("Live", self)
+        btn_layout.addWidget(self.live_smooth)
+        self.smooth_timer = QTimer(self)
+        self.smooth_timer.setSingleShot(True)
+        self.smooth_timer.setInterval(SMOOTH_DEBOUNCE_MS)
+        self.smooth_timer.timeout.connect(self.start_live_smooth)
+        self.sawgol_window.valueChanged.connect(self.on_window_changed)
+        self.live_smooth.toggled.connect(self.on_window_changed)
+        # One worker, queued jobs are dropped when a newer one arrives
+        self.smooth_pool = QThreadPool(self)
+        self.smooth_pool.setMaxThreadCount(1)
+        self.smooth_signals = SmoothSignals(self)
+        self.smooth_signals.finished.connect(self.on_live_smoothed)
+        self.smooth_cache = OrderedDict()
+        self.smooth_data_id = 0
+        self.smooth_job = 0
+
         # Switch snapping method
         self.SnapMax = QCheckBox("Snap to local maxima", self)
         btn_layout.addWidget(self.SnapMax)
@@ -143,6 +142,9 @@ class App(QWidget):
         self.figure = Figure(layout='tight')
         self.canvas = FigureCanvas(self.figure)
         layout.addWidget(self.canvas,stretch=2)
+        # Toolbar for zooming and panning
+        self.toolbar = NavigationToolbar2QT(self.canvas, self)
+        layout.addWidget(self.toolbar)
 
         # Interactive selection
         select_layout = QHBoxLayout()
@@ -185,43 +187,61 @@ class App(QWidget):
         self.df_diff = None
         self.smoothed = None
         self.stored = None
+        self.peak_idx = None
+        self.peak_x = None
         self.x_range = [None,None]
         self.line_eq = None
         self.value = None
         self.i_line = None
+        self.ax = None
+        self.curve = None
+        self.background = None
         self.df_value = None
         self.index_name = None
         self.column_name = None
+        try:
+            self.cache = SpectrumCache()
+        except OSError:
+            # No writable cache folder, files are parsed every time
+            self.cache = None
 
         # Connect the mouse movement event to update cursor position
         self.canvas.mpl_connect('motion_notify_event', self.on_mouse_move)
         FigureCanvas.updateGeometry(self)
         self.canvas.mpl_connect('button_press_event', self.on_click)
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+        self.canvas.mpl_connect('resize_event', self.refresh_curve)
         self.show()
+        # SciPy is only needed for smoothing and peaks, load it while the user picks files
+        QTimer.singleShot(0, lambda: Thread(target=spectra_core.preload, daemon=True).start())
     
 
     def compute_difference(self):
         """Compute the differential curve"""
         if self.df1 is not None and self.df2 is not None:
-            # We assume that background and signal have the same wavelength range
-            self.df_diff = [self.df1[0][1],self.df1[1][1] - self.df2[1][1]]
+            self.df_diff = spectra_core.compute_difference(self.df1, self.df2)
             self.stored =  self.df_diff.copy()
+            # Smoothed curves of the previous data are not valid anymore
+            self.smooth_cache.clear()
+            self.smooth_data_id += 1
             self.index_name = self.df1[0][0]
             self.column_name = self.df1[1][0]
+            self.update_snap_index()
             self.update_plot()
 
 
     def draw_line_between_points(self):
         """Draws a line between two selected points."""
         if len(self.selected_points) == 2:
-            # Clear the previous line if it exists
-            if self.line:
-                self.line.remove()
-
-            ax = self.figure.gca()
+            # Reuse the previous line if it exists
             x_values, y_values = zip(*self.selected_points)
-            self.line, = ax.plot(x_values, y_values, 'r--')  # Red dashed line
-            self.canvas.draw()
+            if self.line is None:
+                # Animated artists are left out of full redraws and blitted on top
+                self.line, = self.ax.plot(x_values, y_values, 'r--', animated=True)  # Red dashed line
+            else:
+                self.line.set_data(x_values, y_values)
+                self.line.set_visible(True)
+            self.blit_overlays()
             # Clear selected points after drawing
             self.selected_points = []
 
@@ -229,46 +249,56 @@ class App(QWidget):
     def draw_line_intensities(self,x):
         """Draws a line for highest value."""
         
-        # Clear the previous line if it exists
-        if self.i_line:
-            self.i_line.remove()
+        # Reuse the previous line if it exists
+        if self.i_line is None:
+            self.i_line = self.ax.axvline(x, color='#AAAAAA', animated=True)  # grey line
+        else:
+            self.i_line.set_xdata([x, x])
+            self.i_line.set_visible(True)
+        self.blit_overlays()
 
-        ax = self.figure.gca()
-        self.i_line = ax.axvline(x, color='#AAAAAA')  # grey line
-        self.canvas.draw()
+
+    def blit_overlays(self):
+        """Redraws only the selection lines on top of the cached plot."""
+        if self.background is None:
+            # Plot was not drawn yet, on_draw paints the lines afterwards
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.background)
+        self.draw_overlays()
+        self.canvas.blit(self.figure.bbox)
+
+
+    def draw_overlays(self):
+        for artist in (self.line, self.i_line):
+            if artist is not None and artist.get_visible():
+                self.ax.draw_artist(artist)
+
+
+    def on_draw(self, event):
+        """Caches the plot without the selection lines after every full redraw."""
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        if self.ax is not None:
+            self.draw_overlays()
 
 
     def get_line(self,x1,x2):
         """Calculate line equation"""
-        idx1 = where(self.df_diff[0]==x1)[0][0]
-        idx2 = where(self.df_diff[0]==x2)[0][0]
-        y1 = self.df_diff[1][idx1]
-        y2 = self.df_diff[1][idx2]
-        a = (y2 - y1) / (x2 - x1)
-        b = y1 - a * x1
-        return(a,b)
+        return spectra_core.get_line(self.df_diff, x1, x2)
 
 
     def get_value(self):
         """Calculates the value with line method"""
         if self.line_eq:
-            values = []
-            a, b = self.line_eq
-            idx1 = where(self.df_diff[0]==self.x_range[0])[0][0]
-            idx2 = where(self.df_diff[0]==self.x_range[1])[0][0]
-
-            temp = []
-            for i in range(idx1,idx2+1):
-                y_line   = a*self.df_diff[0][i]+b
-                y_signal = self.df_diff[1][i]
-                values.append(y_line-y_signal)
-                temp.append([self.df_diff[0][i],values[-1]])
-            self.df_value = temp.copy()
-            self.value = max(values)
-            
+            try:
+                self.value, idx_max, self.df_value = spectra_core.get_value(self.df_diff, self.line_eq, *self.x_range)
+            except ValueError:
+                # e.g. the selected range is outside of a newly loaded curve
+                self.label_diff.setText('Value: ----')
+                return
+
             # Draw line where value was calculated
-            n = argmax(values)
-            self.draw_line_intensities(self.df_value[n][0])
+            self.draw_line_intensities(self.df_diff[0][idx_max])
             
             try:
                 self.label_diff.setText(f'Value: {round(self.value,4)}')
@@ -281,7 +311,7 @@ class App(QWidget):
             options = QFileDialog.Options()
             file_name, _ = QFileDialog.getOpenFileName(self, "Load background file", "", "Text Files (*.txt);;All Files (*)", options=options)
             if file_name:
-                self.df1 = process_data(file_name)
+                self.df1 = load_spectrum(file_name, self.cache)
                 self.update_plot()
 
 
@@ -290,7 +320,7 @@ class App(QWidget):
         options = QFileDialog.Options()
         file_name, _ = QFileDialog.getOpenFileName(self, "Load signal file", "", "Text Files (*.txt);;All Files (*)", options=options)
         if file_name:
-            self.df2 = process_data(file_name)
+            self.df2 = load_spectrum(file_name, self.cache)
             self.update_plot()
 
     # Remove the function below at later stage - not needed anymore
@@ -306,7 +336,8 @@ class App(QWidget):
 
     def on_click(self, event):
         """Handles mouse clicks on the plot."""
-        if event.button == MouseButton.LEFT:
+        # Clicks while zooming or panning do not select points
+        if event.button == MouseButton.LEFT and not self.toolbar.mode:
             x_click = event.xdata
             y_click = event.ydata
 
@@ -340,11 +371,62 @@ class App(QWidget):
     def smooth(self):
         """Smooths the function with Savitzky-Golay filter."""
         if self.stored:
-            # Apply Savitzky-Golay filter on the second column (value) of stored array
-            smoothed_values = savgol_filter(self.stored[1], self.sawgol_window.value(), 2)
-            # Combine the original index (wavelength) and smoothed values into df_diff
-            self.df_diff[1] = smoothed_values
-            self.update_plot()
+            window = self.sawgol_window.value()
+            smoothed_values = self.smooth_cache.get(window)
+            if smoothed_values is None:
+                # Apply Savitzky-Golay filter on the second column (value) of stored array
+                smoothed_values = spectra_core.smooth(self.stored[1], window)
+                self.cache_smoothed(window, smoothed_values)
+            self.apply_smoothed(smoothed_values)
+
+
+    def apply_smoothed(self, smoothed_values):
+        # Combine the original index (wavelength) and smoothed values into df_diff
+        self.df_diff[1] = smoothed_values
+        self.update_snap_index()
+        self.update_plot()
+
+
+    def cache_smoothed(self, window, smoothed_values):
+        self.smooth_cache[window] = smoothed_values
+        self.smooth_cache.move_to_end(window)
+        while len(self.smooth_cache) > SMOOTH_CACHE_SIZE:
+            self.smooth_cache.popitem(last=False)
+
+
+    def on_window_changed(self):
+        """Shows a cached curve at once, otherwise smooths after a short pause in typing."""
+        if not self.live_smooth.isChecked() or not self.stored:
+            return
+        window = self.sawgol_window.value()
+        if window in self.smooth_cache:
+            self.smooth_timer.stop()
+            self.smooth_job += 1  # results of running jobs are stale now
+            self.smooth_cache.move_to_end(window)
+            self.apply_smoothed(self.smooth_cache[window])
+        else:
+            self.smooth_timer.start()
+
+
+    def start_live_smooth(self):
+        """Queues smoothing with the current window on the worker thread."""
+        if not self.stored:
+            return
+        self.smooth_job += 1
+        # Jobs which did not start yet are stale
+        self.smooth_pool.clear()
+        self.smooth_pool.start(SmoothJob(self.smooth_signals, self.smooth_data_id, self.smooth_job,
+                                         self.stored[1], self.sawgol_window.value()))
+
+
+    def on_live_smoothed(self, data_id, job, window, smoothed_values):
+        """Receives the result of a SmoothJob in the GUI thread."""
+        if smoothed_values is None or data_id != self.smooth_data_id:
+            return
+        # Stale results are still valid for their window
+        self.cache_smoothed(window, smoothed_values)
+        if job == self.smooth_job:
+            self.apply_smoothed(smoothed_values)
 
 
     def snap_to_closest_point(self, x_click, y_click):
@@ -353,77 +435,110 @@ class App(QWidget):
         y_values = self.df_diff[1]
 
         # Find the index of the closest x-value
-        idx = (abs(x_values - x_click)).argmin()
+        idx = spectra_core.find_index(x_values, x_click)
 
         return x_values[idx], y_values[idx]
 
 
     def snap_to_closest_maximum(self, x_click, y_click):
         """Find the closest local maximum on the curve to the clicked point."""
-        x_values = self.df_diff[0]
-        y_values = self.df_diff[1]
+        # Curve without local maxima, fall back to the closest datapoint
+        if self.peak_x is None or self.peak_x.shape[0] == 0:
+            return self.snap_to_closest_point(x_click, y_click)
 
-        # Find the indices of all local maxima
-        peaks, _ = find_peaks(y_values)
+        # Find the index of the closest x-value among the cached local maxima
+        idx = self.peak_idx[spectra_core.find_index(self.peak_x, x_click)]
 
-        # Get the x and y values of the local maxima
-        peak_x_values = x_values[peaks]
-        peak_y_values = y_values[peaks]
+        # Return the x and y value of the closest local maximum
+        return self.df_diff[0][idx], self.df_diff[1][idx]
 
-        # Find the index of the closest x-value among the local maxima
-        idx = (abs(peak_x_values - x_click)).argmin()
 
-        # Return the x and y value of the closest local maximum
-        return peak_x_values[idx], peak_y_values[idx]
+    def update_snap_index(self):
+        """Finds the local maxima once per curve change, clicks then only do a binary search."""
+        self.peak_idx = spectra_core.find_maxima(self.df_diff[1])
+        # Wavelengths of the maxima keep the order of the (sorted) wavelength axis
+        self.peak_x = self.df_diff[0][self.peak_idx]
 
 
     def save_val_to_file(self):
         """Saves only the value to file"""
         if self.value:
-            file_path, _ = QFileDialog.getSaveFileName(self, "Save File", "", "Text Files (*.txt);;All Files (*)")
+            file_path, _ = QFileDialog.getSaveFileName(self, "Save File", "", SAVE_FILTER)
             if file_path:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    n1,u1 = self.index_name.split(' ')
-                    n2,u2 = self.column_name.split(' ')
-                    f.write(f"{n1}   ;{n2}\n")
-                    f.write(f"{u1}   ;{u2}\n")
-                    for i in self.df_value:
-                        f.write(f"{i[0]:.6f};{i[1]:.6f}\n")
+                self.write_file(file_path, *self.df_value)
 
 
     def save_diff_to_file(self):
         """Saves the value data to a text file with the specified header."""
         if self.df_diff != None:
-            file_path, _ = QFileDialog.getSaveFileName(self, "Save File", "", "Text Files (*.txt);;All Files (*)")
+            file_path, _ = QFileDialog.getSaveFileName(self, "Save File", "", SAVE_FILTER)
             if file_path:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    n1,u1 = self.index_name.split(' ')
-                    n2,u2 = self.column_name.split(' ')
-                    f.write(f"{n1}   ;{n2}\n")
-                    f.write(f"{u1}   ;{u2}\n")
-                    for i in range(self.df_diff[0].shape[0]):
-                        f.write(f"{self.df_diff[0][i]:.6f};{self.df_diff[1][i]:.6f}\n")
+                self.write_file(file_path, self.df_diff[0], self.df_diff[1])
 
 
+    def write_file(self, file_path, x_values, y_values):
+        """Writes a curve as text, or as a NumPy archive for .npz files."""
+        if file_path.lower().endswith('.npz'):
+            write_curve_npz(file_path, self.index_name, self.column_name, x_values, y_values)
+        else:
+            write_curve(file_path, self.index_name, self.column_name, x_values, y_values)
+
+
+    def lod_bins(self):
+        """One bin of the plotted summary per pixel of the canvas."""
+        return max(self.canvas.width(), LOD_MIN_BINS)
+
+
+    @profiling.stage("plot")
+    def refresh_curve(self, *args):
+        """Summarizes only the visible part of the curve at screen resolution."""
+        if self.ax is None or self.df_diff is None:
+            return
+        x_values = self.df_diff[0]
+        lo, hi = sorted(spectra_core.find_index(x_values, x) for x in self.ax.get_xlim())
+        # One point beyond each edge, so the line continues out of the view
+        lo, hi = max(lo - 1, 0), min(hi + 2, x_values.shape[0])
+        self.curve.set_data(*spectra_core.decimate_minmax(x_values[lo:hi], self.df_diff[1][lo:hi], self.lod_bins()))
+        self.canvas.draw_idle()
+
+
+    @profiling.stage("plot")
     def update_plot(self):
-        self.figure.clear()
-        if self.df_diff is not None:
-            ax = self.figure.add_subplot(111)
-            ax.plot(self.df_diff[0], self.df_diff[1])
-            ax.set_xlabel(self.index_name)
-            ax.set_ylabel(self.column_name)
-            self.canvas.draw()
-            # Make sure to reset selected points and remove any existing line when plot is updated
-            self.selected_points = []
-            if self.line:
-                self.line.remove()
-                self.line = None
-            if self.i_line:
-                self.i_line.remove()
-                self.i_line = None
+        """Updates the curve in place, the axes and lines are created only once."""
+        if self.df_diff is None:
+            return
+        # Make sure to reset selected points and hide any existing line when plot is updated
+        self.selected_points = []
+        for artist in (self.line, self.i_line):
+            if artist is not None:
+                artist.set_visible(False)
+
+        # The curve shows a summary of the whole range, it is refined when the view changes
+        x_values, y_values = spectra_core.decimate_minmax(self.df_diff[0], self.df_diff[1], self.lod_bins())
+        if self.ax is None:
+            self.ax = self.figure.add_subplot(111)
+            self.curve, = self.ax.plot(x_values, y_values)
+            self.ax.callbacks.connect('xlim_changed', self.refresh_curve)
+        else:
+            self.curve.set_data(x_values, y_values)
+            self.ax.relim(visible_only=True)
+            self.ax.autoscale_view()
+        self.ax.set_xlabel(self.index_name)
+        self.ax.set_ylabel(self.column_name)
+
+        # Cached background is stale until the next draw
+        self.background = None
+        self.canvas.draw_idle()
 
 
 if __name__ == '__main__':
+    if '--profile' in argv[:-1]:
+        # Stage timings are written to the given file at exit, see profiling.py
+        i = argv.index('--profile')
+        profiling.enable(argv[i + 1])
+        del argv[i:i + 2]
     app = QApplication(argv)
     ex = App()
+    # Start-up ends when the event loop runs for the first time
+    QTimer.singleShot(0, lambda: profiling.record("startup", STARTED, perf_counter_ns()))
     exit(app.exec_())
@@ -0,0 +1,18 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+# Runs the folder from its parent folder:
+#   python -m SmoothSpectra              opens the window
+#   python -m SmoothSpectra batch ...    headless processing, see batch.py
+
+import os
+import sys
+from runpy import run_path
+
+# The modules of SmoothSpectra import each other by name
+FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, FOLDER)
+
+# Worker processes started with "spawn" import this file as __mp_main__, they must not start the program again
+if __name__ == '__main__':
+    run_path(os.path.join(FOLDER, "SmoothSpectra.py"), run_name="__main__")
@@ -0,0 +1,325 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+# Headless processing of background/signal pairs, runs without PyQt5 and matplotlib.
+# Usage: python batch.py DIRECTORY_OR_MANIFEST [options]
+#    or: python SmoothSpectra.py batch DIRECTORY_OR_MANIFEST [options]
+#    or: python -m SmoothSpectra batch DIRECTORY_OR_MANIFEST [options], from the folder above this one
+
+import os
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from sys import exit
+from typing import NamedTuple
+from uuid import uuid4
+from numpy import array_equal, nan
+
+import profiling
+import spectra_core
+from spectra_cache import SpectrumCache, load_spectrum
+from spectra_io import append_dataset, make_dataset, read_dataset, write_curve, write_dataset
+
+
+# Stem suffix which marks background files, e.g. sample1_bg.txt pairs with sample1*.txt
+BACKGROUND_MARKER = "_bg"
+
+
+class PairResult(NamedTuple):
+    background: str
+    signal: str
+    value: float = None
+    x_max: float = None
+    error: str = None
+
+
+def pair_files(directory, marker=BACKGROUND_MARKER, extension=".txt"):
+    """
+    Pairs background files with signal files found in a directory.
+    Background files have stems ending with `marker`, all other files
+    whose stem starts with the remaining part are their signals.
+    If a signal matches more than one background, the longest match wins.
+    Parameters:
+    - directory: folder with the exported spectra
+    - marker: stem suffix of background files
+    - extension: extension of the data files
+
+    Returns:
+    - list of (background, signal) paths sorted by signal name
+    """
+    names = sorted(n for n in os.listdir(directory)
+                   if n.lower().endswith(extension) and os.path.isfile(os.path.join(directory, n)))
+    stems = {n: os.path.splitext(n)[0] for n in names}
+    backgrounds = {stems[n][:-len(marker)]: n for n in names if stems[n].endswith(marker)}
+    # Longest base first, so "run10_bg" wins over "run1_bg" for "run10_2"
+    bases = sorted(backgrounds, key=len, reverse=True)
+
+    pairs = []
+    for name in names:
+        if stems[name].endswith(marker):
+            continue
+        for base in bases:
+            if stems[name].startswith(base):
+                pairs.append((os.path.join(directory, backgrounds[base]), os.path.join(directory, name)))
+                break
+    return pairs
+
+
+def read_manifest(path):
+    """
+    Reads background/signal pairs from a manifest file.
+    Every line holds "background;signal", relative paths are resolved
+    against the folder of the manifest. Empty lines and lines starting
+    with # are ignored.
+    """
+    root = os.path.dirname(os.path.abspath(path))
+    pairs = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            cells = [cell.strip() for cell in line.split(";")]
+            if len(cells) != 2:
+                raise ValueError(f"{path}:{line_no}: expected 'background;signal'")
+            pairs.append(tuple(os.path.join(root, cell) for cell in cells))
+    return pairs
+
+
+def _error(e):
+    return f"{type(e).__name__}: {e}"
+
+
+def _process_stack(df1, signals, window=None, x_range=None, kind='linear'):
+    """
+    Difference, smoothing and value of signals covering the same range of the background.
+
+    Returns:
+    - (df_diff, values, x_max, df_value), the last three are None without x_range
+    """
+    df_diff = spectra_core.stack_difference(df1, signals, kind)
+    if window:
+        df_diff[1] = spectra_core.smooth(df_diff[1], window)
+
+    values = x_max = df_value = None
+    if x_range is not None:
+        line_eq = spectra_core.get_line(df_diff, *x_range)
+        values, idx_max, df_value = spectra_core.get_value(df_diff, line_eq, *x_range)
+        x_max = df_diff[0][idx_max]
+    return df_diff, values, x_max, df_value
+
+
+def process_group(background, signals, window=None, x_range=None, output_dir=None, cache=None, kind='linear',
+                  dataset_part=None):
+    """
+    Runs the difference -> smooth -> value pipeline for signals sharing one background.
+    Signals covering the same range of the background are processed as one 2D stack,
+    every curve is the same as when its pair is processed alone. A signal which fails
+    (unreadable file, curve shorter than the window, ...) gets an error result and
+    does not stop the others.
+    Parameters:
+    - background: path to the background file
+    - signals: paths to the signal files
+    - window: Savitzky-Golay window, no smoothing if None
+    - x_range: (x1, x2) baseline range, no value is calculated if None
+    - output_dir: folder for the diff (and value) curves, nothing is written if None
+    - cache: SpectrumCache for the parsed files, files are always parsed if None
+    - kind: interpolation used when a signal has another wavelength axis
+    - dataset_part: .npz file for the diff curves of this stack (see spectra_io.write_dataset), not written if None
+
+    Returns:
+    - list of PairResult in the order of signals
+    """
+    try:
+        df1 = load_spectrum(background, cache)
+    except Exception as e:
+        return [PairResult(background, signal, error=_error(e)) for signal in signals]
+
+    results = {}
+    loaded = []
+    for signal in signals:
+        try:
+            df2 = load_spectrum(signal, cache)
+            if not array_equal(df1[0][1], df2[0][1]):
+                # A signal which cannot be resampled fails alone, the plan is reused by the stack
+                spectra_core.get_plan(df2[0][1], df1[0][1])
+            loaded.append((signal, df2))
+        except Exception as e:
+            results[signal] = PairResult(background, signal, error=_error(e))
+
+    stacks = []
+    for group in spectra_core.group_by_range(df1, [df2 for _, df2 in loaded]):
+        members = [loaded[i] for i in group]
+        try:
+            stacks.append((members, _process_stack(df1, [df2 for _, df2 in members], window, x_range, kind)))
+        except Exception:
+            # Find the signals which failed the stack, the others are processed alone
+            for signal, df2 in members:
+                try:
+                    stacks.append(([(signal, df2)], _process_stack(df1, [df2], window, x_range, kind)))
+                except Exception as e:
+                    results[signal] = PairResult(background, signal, error=_error(e))
+
+    index_name, column_name = df1[0][0], df1[1][0]
+    curves = []
+    for members, (df_diff, values, x_max, df_value) in stacks:
+        for i, (signal, _) in enumerate(members):
+            try:
+                if output_dir is not None:
+                    stem = os.path.splitext(os.path.basename(signal))[0]
+                    write_curve(os.path.join(output_dir, f"{stem}_diff.txt"), index_name, column_name,
+                                df_diff[0], df_diff[1][i])
+                    if df_value is not None:
+                        write_curve(os.path.join(output_dir, f"{stem}_val.txt"), index_name, column_name,
+                                    df_value[0], df_value[1][i])
+                if values is None:
+                    results[signal] = PairResult(background, signal)
+                else:
+                    results[signal] = PairResult(background, signal, values[i], x_max[i])
+            except Exception as e:
+                results[signal] = PairResult(background, signal, error=_error(e))
+                continue
+            if dataset_part is not None:
+                curves.append({"name": os.path.basename(signal), "background": os.path.basename(background),
+                               "index_name": index_name, "column_name": column_name,
+                               "result": nan if values is None else values[i],
+                               "x_max": nan if values is None else x_max[i],
+                               "wavelength": df_diff[0], "value": df_diff[1][i]})
+
+    if curves:
+        write_dataset(dataset_part, make_dataset(curves))
+    return [results[signal] for signal in signals]
+
+
+def _process_task(task):
+    """Runs process_group, an unexpected exception only fails the signals of this task."""
+    background, signals = task[:2]
+    try:
+        return process_group(*task)
+    except Exception as e:
+        return [PairResult(background, signal, error=_error(e)) for signal in signals]
+
+
+def run_batch(pairs, window=None, x_range=None, output_dir=None, workers=None, chunksize=None, cache=None,
+              kind='linear', dataset=None):
+    """
+    Processes background/signal pairs on a pool of worker processes.
+    Signals of the same background are processed together as stacks.
+    Parameters:
+    - pairs: list of (background, signal) paths
+    - window, x_range, output_dir, cache, kind: see process_group
+    - workers: number of processes, all cores if None, 1 runs in this process
+    - chunksize: signals processed in one stack, by default every worker gets about 4 stacks
+    - dataset: dataset folder the diff curves are appended to as one part, see spectra_io.append_dataset
+
+    Returns:
+    - list of PairResult in the same order as pairs
+    """
+    workers = min(workers or os.cpu_count() or 1, len(pairs)) or 1
+    if chunksize is None:
+        chunksize = max(1, -(-len(pairs) // (workers * 4)))
+
+    # Group signals by background and split the groups into stacks of at most chunksize signals
+    groups = {}
+    for background, signal in pairs:
+        groups.setdefault(background, []).append(signal)
+    tasks = []
+    # Parts left by an aborted run have another name and are never merged
+    run = uuid4().hex[:12]
+    for background, signals in groups.items():
+        for i in range(0, len(signals), chunksize):
+            # Workers write separate parts, they are appended to the dataset at the end
+            part = None if dataset is None else f"{dataset}.{run}.part{len(tasks)}.tmp"
+            tasks.append((background, signals[i:i + chunksize], window, x_range, output_dir, cache, kind, part))
+
+    parts = [task[-1] for task in tasks] if dataset is not None else []
+    try:
+        if workers == 1:
+            done = [_process_task(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                done = list(pool.map(_process_task, tasks))
+        written = [part for part in parts if os.path.exists(part)]
+        if dataset is not None:
+            append_dataset(dataset, [read_dataset(part) for part in written])
+    finally:
+        for part in parts:
+            if os.path.exists(part):
+                os.remove(part)
+
+    # Back to the order of the input
+    by_pair = {(r.background, r.signal): r for results in done for r in results}
+    return [by_pair[pair] for pair in pairs]
+
+
+def write_summary(path, results):
+    """Writes value of every pair (or the error) to a semicolon separated file."""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("Background;Signal;Value;X;Error\n")
+        for r in results:
+            value = "" if r.value is None else f"{r.value:.6f}"
+            x_max = "" if r.x_max is None else f"{r.x_max:.6f}"
+            f.write(f"{os.path.basename(r.background)};{os.path.basename(r.signal)};{value};{x_max};{(r.error or '').replace(';', ',')}\n")
+
+
+def build_parser():
+    parser = ArgumentParser(prog="SmoothSpectra batch",
+                            description="Subtract signal from background, smooth and calculate values without the GUI.")
+    parser.add_argument("source", help="folder with background/signal files or a manifest with 'background;signal' lines")
+    parser.add_argument("-o", "--output", default="SmoothSpectra_output", help="output folder (default: %(default)s)")
+    parser.add_argument("-w", "--window", type=int, default=None, help="Savitzky-Golay window, no smoothing when omitted")
+    parser.add_argument("--x1", type=float, help="start of the baseline range")
+    parser.add_argument("--x2", type=float, help="end of the baseline range")
+    parser.add_argument("--dataset", default=None,
+                        help="append all diff curves, values and headers to this binary dataset folder")
+    parser.add_argument("--no-text", action="store_true", help="do not write the text diff and value curves")
+    parser.add_argument("--marker", default=BACKGROUND_MARKER,
+                        help="stem suffix of background files when pairing a folder (default: %(default)s)")
+    parser.add_argument("--interp", choices=spectra_core.INTERPOLATION_KINDS, default='linear',
+                        help="resampling of signals with another wavelength axis (default: %(default)s)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes (default: all cores)")
+    parser.add_argument("--chunksize", type=int, default=None, help="signals processed together in one stack")
+    parser.add_argument("--cache-dir", default=None, help="folder of the parsed file cache (default: ~/.cache/SmoothSpectra)")
+    parser.add_argument("--cache-mb", type=float, default=None, help="size limit of the parsed file cache in MB")
+    parser.add_argument("--no-cache", action="store_true", help="always parse the text files")
+    parser.add_argument("--profile", default=None,
+                        help="record stage timings to a Chrome trace (.json) or cProfile (.prof) file")
+    return parser
+
+
+def main(args=None):
+    options = build_parser().parse_args(args)
+    if options.profile:
+        profiling.enable(options.profile)
+    if (options.x1 is None) != (options.x2 is None):
+        print("Both --x1 and --x2 are needed to calculate values")
+        return 2
+    x_range = None if options.x1 is None else (options.x1, options.x2)
+
+    if os.path.isdir(options.source):
+        pairs = pair_files(options.source, options.marker)
+    else:
+        pairs = read_manifest(options.source)
+    if not pairs:
+        print(f"No background/signal pairs found in {options.source}")
+        return 1
+
+    cache = None
+    if not options.no_cache:
+        max_bytes = None if options.cache_mb is None else int(options.cache_mb * 1024 * 1024)
+        cache = SpectrumCache(options.cache_dir, max_bytes)
+
+    os.makedirs(options.output, exist_ok=True)
+    output_dir = None if options.no_text else options.output
+    results = run_batch(pairs, options.window, x_range, output_dir, options.workers, options.chunksize, cache,
+                        options.interp, options.dataset)
+
+    write_summary(os.path.join(options.output, "values.txt"), results)
+    failed = [r for r in results if r.error]
+    print(f"Processed {len(results) - len(failed)}/{len(results)} pairs, results in {options.output}")
+    for r in failed:
+        print(f"  {os.path.basename(r.signal)}: {r.error}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,160 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+# Benchmark of the processing pipeline on synthetic files, runs without a display.
+# Usage: python bench.py [--rows 10000 100000 1000000] [--output results.json]
+
+import os
+import json
+import platform
+import subprocess
+import tracemalloc
+from argparse import ArgumentParser
+from sys import exit
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import numpy
+import scipy
+from numpy import linspace, exp, sin
+from numpy.random import default_rng
+
+import spectra_core
+from spectra_io import process_data
+
+
+# Header lines and number of columns of the synthetic exports
+LAYOUTS = {
+    # Column names and units, two columns
+    "names_units": (["Wavelength;Intensity", "nm;counts"], 2),
+    # Instrument export with a title line and extra columns
+    "multi_column": (["Measurement;;;", "Wavelength;Dark;Reference;Intensity", "nm;counts;counts;counts"], 4),
+    # No separators, the first 7 lines are skipped
+    "single_column": ([f"Comment line {i}" for i in range(7)], 1),
+}
+SMOOTH_WINDOW = 51
+CLICKS = 1000
+
+
+def write_synthetic(path, layout, rows, seed=0):
+    """Writes a spectrum export with decimal commas, returns the path."""
+    header, width = LAYOUTS[layout]
+    rng = default_rng(seed)
+    x = linspace(200, 800, rows)
+    y = 1000 + 200 * sin(x / 15) - 300 * exp(-((x - 500) / 20) ** 2) + rng.normal(0, 5, rows)
+    # A single column is used as both wavelength and value, keep it sorted
+    columns = [x] + [y] * (width - 1) if width > 1 else [x]
+    with open(path, 'w', encoding='utf-8') as f:
+        for line in header:
+            f.write(line + "\n")
+        # Whole block formatted at once, the benchmark should not wait for its input
+        fmt = ";".join(["%.4f"] * width) + "\n"
+        block = numpy.column_stack(columns)
+        step = 100000
+        for i in range(0, rows, step):
+            f.write((fmt * block[i:i + step].shape[0] % tuple(block[i:i + step].ravel())).replace(".", ","))
+    return path
+
+
+def measure(function, *args, repeat=3):
+    """
+    Best time of `repeat` calls and peak memory of one call (bytes traced by tracemalloc).
+    A first untimed call warms up lazy imports and caches, it is not counted.
+    """
+    result = function(*args)
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        result = function(*args)
+        best = min(best, perf_counter() - start)
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, best, peak
+
+
+def bench_file(background, signal, repeat=3):
+    """Times every stage of the pipeline for one background/signal pair."""
+    results = []
+
+    def stage(name, function, *args):
+        result, seconds, peak = measure(function, *args, repeat=repeat)
+        results.append({"stage": name, "seconds": seconds, "peak_bytes": peak})
+        return result
+
+    df1 = stage("parse", process_data, background)
+    df2 = process_data(signal)
+    df_diff = stage("difference", spectra_core.compute_difference, df1, df2)
+    n = df_diff[0].shape[0]
+    window = min(SMOOTH_WINDOW, n - n % 2 - 1)
+    if window > spectra_core.SAVGOL_ORDER:
+        df_diff[1] = stage("smooth", spectra_core.smooth, df_diff[1], window)
+
+    x_values = df_diff[0]
+    x1, x2 = x_values[n // 4], x_values[3 * n // 4]
+    line_eq = stage("get_line", spectra_core.get_line, df_diff, x1, x2)
+    stage("get_value", spectra_core.get_value, df_diff, line_eq, x1, x2)
+    peaks = stage("find_maxima", spectra_core.find_maxima, df_diff[1])
+
+    # Clicks spread over the whole axis, like snap_to_closest_point and snap_to_closest_maximum
+    clicks = default_rng(1).uniform(x_values.min(), x_values.max(), CLICKS)
+    stage("snap_point", lambda: [spectra_core.find_index(x_values, x) for x in clicks])
+    if peaks.shape[0]:
+        peak_x = x_values[peaks]
+        stage("snap_maximum", lambda: [spectra_core.find_index(peak_x, x) for x in clicks])
+    stage("decimate", spectra_core.decimate_minmax, x_values, df_diff[1], 2000)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def build_parser():
+    parser = ArgumentParser(description="Benchmark the SmoothSpectra processing pipeline on synthetic files.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000], help="data rows of the files")
+    parser.add_argument("--layouts", nargs="+", choices=sorted(LAYOUTS), default=sorted(LAYOUTS), help="header layouts")
+    parser.add_argument("--repeat", type=int, default=3, help="calls per stage, the best time is reported")
+    parser.add_argument("--label", default=None, help="name of this run in the results")
+    parser.add_argument("-o", "--output", default=None, help="JSON file for the results (default: print only)")
+    return parser
+
+
+def main(args=None):
+    options = build_parser().parse_args(args)
+    run = {
+        "label": options.label,
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "scipy": scipy.__version__,
+        "machine": platform.platform(),
+        "results": [],
+    }
+    # SciPy modules are imported on first use, not during the first timed stage
+    spectra_core.preload()
+    with TemporaryDirectory() as tmp:
+        for layout in options.layouts:
+            for rows in options.rows:
+                background = write_synthetic(os.path.join(tmp, "bg.txt"), layout, rows, seed=0)
+                signal = write_synthetic(os.path.join(tmp, "signal.txt"), layout, rows, seed=1)
+                size = os.path.getsize(background)
+                for result in bench_file(background, signal, options.repeat):
+                    result.update(layout=layout, rows=rows, file_bytes=size)
+                    run["results"].append(result)
+                    print(f"{layout:>14} {rows:>9} {result['stage']:>13} "
+                          f"{result['seconds'] * 1000:10.2f} ms {result['peak_bytes'] / 1e6:10.2f} MB")
+
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as f:
+            json.dump(run, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,167 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+# Opt-in timing of the processing stages.
+# Enable with the SMOOTHSPECTRA_PROFILE environment variable or the --profile option:
+#   SMOOTHSPECTRA_PROFILE=trace.json  -> Chrome trace (open in chrome://tracing or ui.perfetto.dev)
+#   SMOOTHSPECTRA_PROFILE=stats.prof  -> cProfile statistics (python -m pstats stats.prof)
+# Worker processes write their own files (trace.<main pid>-<pid>.json), Chrome traces are merged at exit.
+
+import os
+import re
+import json
+import threading
+from cProfile import Profile
+from functools import wraps
+from multiprocessing.util import Finalize, register_after_fork
+from sys import stderr
+from time import perf_counter_ns
+from numpy import ndarray
+
+
+PROFILE_ENV = "SMOOTHSPECTRA_PROFILE"
+# Process which enabled the instrumentation, other processes write separate files
+PROFILE_PID_ENV = "SMOOTHSPECTRA_PROFILE_PID"
+
+
+class Recorder:
+    """Collects stage timings of this process and writes them at exit."""
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.events = []
+        self.profiler = None
+
+    def enable(self, path):
+        os.environ[PROFILE_ENV] = path
+        os.environ.setdefault(PROFILE_PID_ENV, str(os.getpid()))
+        self.path = path
+        self.start()
+
+    def start(self):
+        self.events = []
+        if self.path.endswith(".prof"):
+            self.profiler = Profile()
+            self.profiler.enable()
+        # Finalizers also run when pool workers exit, atexit handlers do not
+        Finalize(self, Recorder.dump, args=(self,), exitpriority=100)
+        self.enabled = True
+
+    def after_fork(self):
+        if self.enabled:
+            if self.profiler is not None:
+                # Profiler of the parent process is still installed in the child
+                self.profiler.disable()
+            self.start()
+
+    def output_path(self):
+        main_pid = os.environ.get(PROFILE_PID_ENV)
+        if main_pid == str(os.getpid()):
+            return self.path
+        # The pid of the main process ties the file to its run, see merge_worker_traces
+        stem, ext = os.path.splitext(self.path)
+        return f"{stem}.{main_pid}-{os.getpid()}{ext}"
+
+    def dump(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        path = self.output_path()
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(path)
+        else:
+            events = [trace_event(*event) for event in self.events]
+            if path == self.path:
+                events += merge_worker_traces(self.path)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        if path == self.path:
+            print_summary(self.events)
+
+
+def trace_event(name, start, end, pid, tid, items_in, items_out):
+    return {"name": name, "cat": "stage", "ph": "X", "ts": start / 1000, "dur": (end - start) / 1000,
+            "pid": pid, "tid": tid, "args": {"items_in": items_in, "items_out": items_out}}
+
+
+def merge_worker_traces(path, main_pid=None):
+    """
+    Events written by the worker processes of this run, their files are removed.
+    Only files named <stem>.<main_pid>-<pid><ext> (see Recorder.output_path) are read, main_pid defaults
+    to this process, other files next to the trace are left alone.
+    """
+    directory, name = os.path.split(path)
+    stem, ext = os.path.splitext(name)
+    pattern = re.compile(rf"{re.escape(stem)}\.{main_pid or os.getpid()}-\d+{re.escape(ext)}")
+    events = []
+    for worker_name in sorted(os.listdir(directory or ".")):
+        if not pattern.fullmatch(worker_name):
+            continue
+        worker_path = os.path.join(directory, worker_name)
+        try:
+            with open(worker_path, 'r', encoding='utf-8') as f:
+                events += json.load(f)["traceEvents"]
+            os.remove(worker_path)
+        except (OSError, ValueError, KeyError):
+            pass
+    return events
+
+
+def print_summary(events):
+    totals = {}
+    for name, start, end, _, _, items_in, _ in events:
+        calls, ns, items = totals.get(name, (0, 0, 0))
+        totals[name] = (calls + 1, ns + end - start, items + items_in)
+    if not totals:
+        return
+    print(f"{'stage':>12} {'calls':>7} {'total ms':>10} {'mean ms':>10} {'mean items':>11}", file=stderr)
+    for name, (calls, ns, items) in sorted(totals.items(), key=lambda item: -item[1][1]):
+        print(f"{name:>12} {calls:>7} {ns / 1e6:10.2f} {ns / 1e6 / calls:10.3f} {items // calls:>11}", file=stderr)
+
+
+def count_items(obj, depth=3):
+    """Number of array elements in obj, arrays nested in tuples and lists are counted too."""
+    if isinstance(obj, ndarray):
+        return obj.size
+    if depth and isinstance(obj, (tuple, list)):
+        return sum(count_items(item, depth - 1) for item in obj)
+    return 0
+
+
+recorder = Recorder()
+register_after_fork(recorder, Recorder.after_fork)
+
+
+def stage(name):
+    """Decorator recording duration and array sizes of every call while profiling is enabled."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not recorder.enabled:
+                return function(*args, **kwargs)
+            start = perf_counter_ns()
+            result = function(*args, **kwargs)
+            end = perf_counter_ns()
+            recorder.events.append((name, start, end, os.getpid(), threading.get_ident(),
+                                    count_items(args), count_items(result)))
+            return result
+        return wrapper
+    return decorator
+
+
+def record(name, start, end):
+    """Records a span measured elsewhere, times from perf_counter_ns."""
+    if recorder.enabled:
+        recorder.events.append((name, start, end, os.getpid(), threading.get_ident(), 0, 0))
+
+
+def enable(path):
+    """Starts recording, the results are written to path when the process exits."""
+    if not recorder.enabled:
+        recorder.enable(path)
+
+
+# Spawned worker processes and runs started with the environment variable
+if os.environ.get(PROFILE_ENV):
+    enable(os.environ[PROFILE_ENV])
@@ -0,0 +1,155 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+import os
+import json
+from collections import OrderedDict
+from hashlib import sha1
+from numpy import load, save, stack
+
+from profiling import stage
+from spectra_io import process_data
+
+
+# Environment variables overriding the default cache folder and size limit (MB)
+CACHE_DIR_ENV = "SMOOTHSPECTRA_CACHE_DIR"
+CACHE_SIZE_ENV = "SMOOTHSPECTRA_CACHE_MB"
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "SmoothSpectra")
+DEFAULT_CACHE_MB = 512
+ENTRY_EXTENSIONS = (".npy", ".json")
+
+# CacheUsage of every cache folder used by this process, the folder is listed only once
+_usage = {}
+
+
+class CacheUsage:
+    """
+    Sizes of the entries of a cache folder in least recently used order, with their total.
+    The folder is listed once, afterwards stored, used and removed entries are tracked in memory.
+    Entries stored by other processes are counted when a process lists the folder.
+    """
+    def __init__(self, directory):
+        self.sizes = OrderedDict()  # entry -> bytes, least recently used first
+        self.total = 0
+        entries = {}
+        with os.scandir(directory) as it:
+            for item in it:
+                stem, ext = os.path.splitext(item.name)
+                if ext not in ENTRY_EXTENSIONS:
+                    continue
+                try:
+                    stat = item.stat()
+                except OSError:
+                    continue  # Removed by another process
+                size, used = entries.get(stem, (0, 0))
+                # Use time is kept on the .json file
+                entries[stem] = (size + stat.st_size, max(used, stat.st_mtime) if ext == ".json" else used)
+        for stem, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+            self.add(stem, size)
+
+    def add(self, stem, size):
+        self.total += size - self.sizes.pop(stem, 0)
+        self.sizes[stem] = size
+
+    def use(self, stem):
+        self.sizes.move_to_end(stem)
+
+    def pop_oldest(self):
+        stem, size = self.sizes.popitem(last=False)
+        self.total -= size
+        return stem
+
+
+class SpectrumCache:
+    """
+    Persistent cache of parsed spectra.
+    Every entry is a .npy file with the wavelength and value rows and a .json
+    file with the headers. Entries are keyed by the path, mtime and size of
+    the source file, so a changed file is parsed again. Arrays are loaded with
+    memory mapping and the least recently used entries are removed when the
+    cache grows over its size limit, see CacheUsage.
+    """
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or os.environ.get(CACHE_DIR_ENV) or DEFAULT_CACHE_DIR
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get(CACHE_SIZE_ENV, DEFAULT_CACHE_MB)) * 1024 * 1024)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def usage(self):
+        directory = os.path.abspath(self.directory)
+        if directory not in _usage:
+            _usage[directory] = CacheUsage(directory)
+        return _usage[directory]
+
+    def key(self, path):
+        stat = os.stat(path)
+        source = f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}"
+        return sha1(source.encode('utf-8')).hexdigest()
+
+    @stage("cache")
+    def get(self, path):
+        """Cached result of process_data for path or None."""
+        key = self.key(path)
+        entry = os.path.join(self.directory, key)
+        try:
+            with open(entry + ".json", 'r', encoding='utf-8') as f:
+                headers = json.load(f)
+            data = load(entry + ".npy", mmap_mode='r')
+            # Mark the entry as recently used, the file time keeps the order for the next process
+            os.utime(entry + ".json")
+        except (OSError, ValueError):
+            return None
+        if key in self.usage().sizes:
+            self.usage().use(key)
+        else:
+            # Stored by another process after the folder was listed
+            self.count(key)
+        return ((headers[0], data[0]), (headers[1], data[1]))
+
+    @stage("cache")
+    def put(self, path, result):
+        """Stores a process_data result of path."""
+        key = self.key(path)
+        entry = os.path.join(self.directory, key)
+        # Write to temporary files first, parallel batch workers may store the same file
+        tmp = f"{entry}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            save(f, stack((result[0][1], result[1][1])))
+        os.replace(tmp, entry + ".npy")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump([result[0][0], result[1][0]], f)
+        os.replace(tmp, entry + ".json")
+        self.count(key)
+        self.evict()
+
+    def count(self, key):
+        """Adds a stored entry to the usage, unless another process removed it meanwhile"""
+        entry = os.path.join(self.directory, key)
+        try:
+            size = sum(os.path.getsize(entry + ext) for ext in ENTRY_EXTENSIONS)
+        except OSError:
+            return
+        self.usage().add(key, size)
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in max_bytes."""
+        usage = self.usage()
+        while usage.total > self.max_bytes and usage.sizes:
+            stem = usage.pop_oldest()
+            for ext in ENTRY_EXTENSIONS:
+                try:
+                    os.remove(os.path.join(self.directory, stem + ext))
+                except OSError:
+                    pass  # Removed by another process
+
+
+def load_spectrum(path, cache=None):
+    """process_data with an optional SpectrumCache in front of it, a cache limited to 0 bytes is disabled."""
+    if cache is None or cache.max_bytes <= 0:
+        return process_data(path)
+    result = cache.get(path)
+    if result is None:
+        result = process_data(path)
+        cache.put(path, result)
+    return result
@@ -0,0 +1,271 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+# Numerical core of SmoothSpectra, it does not depend on PyQt5 or matplotlib
+from collections import OrderedDict
+from hashlib import blake2b
+from numpy import (
+    arange, array_equal, asarray, ascontiguousarray, clip, concatenate, empty, maximum, minimum, searchsorted, stack
+)
+from profiling import stage
+
+
+# Polynomial order used by the Savitzky-Golay filter
+SAVGOL_ORDER = 2
+# Interpolations available to align the signal with the background grid
+INTERPOLATION_KINDS = ('linear', 'cubic')
+# Number of interpolation plans kept for reuse
+PLAN_CACHE_SIZE = 32
+_plans = OrderedDict()
+
+
+class InterpolationPlan:
+    """
+    Resampling of values from a source wavelength grid onto a target grid.
+    Positions and weights are computed once and reused for every curve on
+    the same pair of grids. Target points outside of the source range are
+    left out, `mask` selects the target points that are kept.
+    """
+    def __init__(self, source, target):
+        if source.shape[0] < 2:
+            raise ValueError("At least two points are needed to interpolate")
+        # Spectrometers may export the wavelength axis in descending order
+        self.flip = source[0] > source[-1]
+        self.source = source[::-1] if self.flip else source
+        self.mask = (target >= self.source[0]) & (target <= self.source[-1])
+        if not self.mask.any():
+            raise ValueError("Wavelength ranges of background and signal do not overlap")
+        self.target = target[self.mask]
+        self.index = clip(searchsorted(self.source, self.target, side='right') - 1, 0, self.source.shape[0] - 2)
+        x0 = self.source[self.index]
+        self.weight = (self.target - x0) / (self.source[self.index + 1] - x0)
+
+    def apply(self, values, kind='linear'):
+        """Values on the source grid resampled onto the kept target points."""
+        values = values[::-1] if self.flip else values
+        if kind == 'linear':
+            return values[self.index] * (1 - self.weight) + values[self.index + 1] * self.weight
+        if kind == 'cubic':
+            from scipy.interpolate import CubicSpline
+            return CubicSpline(self.source, values)(self.target)
+        raise ValueError(f"Unknown interpolation {kind!r}, use one of {INTERPOLATION_KINDS}")
+
+
+def _grid_key(x_values):
+    return x_values.shape[0], blake2b(ascontiguousarray(x_values).tobytes(), digest_size=16).digest()
+
+
+def get_plan(source, target):
+    """InterpolationPlan from source onto target, reused for grids seen recently."""
+    key = (_grid_key(source), _grid_key(target))
+    plan = _plans.get(key)
+    if plan is None:
+        plan = InterpolationPlan(source, target)
+        _plans[key] = plan
+        while len(_plans) > PLAN_CACHE_SIZE:
+            _plans.popitem(last=False)
+    else:
+        _plans.move_to_end(key)
+    return plan
+
+
+def preload():
+    """Imports the SciPy modules used here, which are otherwise loaded on first use."""
+    import scipy.signal
+
+
+@stage("difference")
+def compute_difference(df1, df2, kind='linear'):
+    """
+    Computes the differential curve (background - signal).
+    If the wavelength axes differ, the signal is resampled onto the
+    background axis, limited to the range covered by both files.
+    Parameters:
+    - df1: background as returned by process_data
+    - df2: signal as returned by process_data
+    - kind: interpolation used for different axes, 'linear' or 'cubic'
+
+    Returns:
+    - list of [wavelength, difference] NumPy arrays
+    """
+    x1, y1 = df1[0][1], df1[1][1]
+    x2, y2 = df2[0][1], df2[1][1]
+    if array_equal(x1, x2):
+        return [x1, y1 - y2]
+    plan = get_plan(x2, x1)
+    return [plan.target, y1[plan.mask] - plan.apply(y2, kind)]
+
+
+def group_by_range(df1, signals):
+    """
+    Groups signals which cover the same part of the background axis, so they can be stacked
+    without cutting any of them to a shorter range.
+    Parameters:
+    - df1: background as returned by process_data
+    - signals: list of signals as returned by process_data
+
+    Returns:
+    - list of lists of indices into signals, in the order of their first signal
+    """
+    x1 = df1[0][1]
+    groups = OrderedDict()
+    for i, df2 in enumerate(signals):
+        x2 = df2[0][1]
+        key = None
+        if not array_equal(x1, x2):
+            mask = get_plan(x2, x1).mask
+            key = None if mask.all() else _grid_key(mask)
+        groups.setdefault(key, []).append(i)
+    return list(groups.values())
+
+
+@stage("difference")
+def stack_difference(df1, signals, kind='linear'):
+    """
+    Computes the differential curves of many signals against one background.
+    Signals with another wavelength axis are resampled like in compute_difference,
+    every row is the same as compute_difference of its signal. All signals have to
+    cover the same range of the background axis, see group_by_range.
+    Parameters:
+    - df1: background as returned by process_data
+    - signals: list of signals as returned by process_data
+    - kind: interpolation used for different axes, 'linear' or 'cubic'
+
+    Returns:
+    - [wavelength, differences] where differences is a 2D array with one row per signal
+    """
+    x1, y1 = df1[0][1], df1[1][1]
+    mask = None
+    rows = empty((len(signals), x1.shape[0]))
+    for i, df2 in enumerate(signals):
+        x2, y2 = df2[0][1], df2[1][1]
+        if array_equal(x1, x2):
+            rows[i] = y2
+            signal_mask = None
+        else:
+            plan = get_plan(x2, x1)
+            rows[i, plan.mask] = plan.apply(y2, kind)
+            signal_mask = None if plan.mask.all() else plan.mask
+        if i == 0:
+            mask = signal_mask
+        elif not (mask is None and signal_mask is None or
+                  mask is not None and signal_mask is not None and array_equal(mask, signal_mask)):
+            raise ValueError("Signals cover different ranges of the background axis, stack them separately")
+    if mask is None:
+        return [x1, y1 - rows]
+    return [x1[mask], y1[mask] - rows[:, mask]]
+
+
+@stage("smooth")
+def smooth(values, window, order=SAVGOL_ORDER):
+    """Smooths the values with Savitzky-Golay filter, every row of a 2D stack is smoothed separately."""
+    from scipy.signal import savgol_filter
+    return savgol_filter(values, window, order, axis=-1)
+
+
+@stage("peaks")
+def find_maxima(values):
+    """Indices of all local maxima, in the order of the curve."""
+    from scipy.signal import find_peaks
+    peaks, _ = find_peaks(values)
+    return peaks
+
+
+def find_index(x_values, x):
+    """Index of the datapoint closest to x, found by binary search on the sorted (ascending or descending) axis."""
+    n = x_values.shape[0]
+    if n > 1 and x_values[0] > x_values[-1]:
+        return n - 1 - find_index(x_values[::-1], x)
+    i = searchsorted(x_values, x)
+    if i == 0:
+        return 0
+    if i == n:
+        return n - 1
+    # Pick the closer of the two neighbours
+    return i if x_values[i] - x < x - x_values[i - 1] else i - 1
+
+
+def range_indexes(x_values, x1, x2):
+    """
+    Indexes of the datapoints closest to x1 and x2.
+    Raises ValueError when x1 or x2 is outside of the axis or both are the same datapoint,
+    find_index would silently pick the first or last datapoint instead.
+    """
+    low, high = x_values.min(), x_values.max()
+    for x in (x1, x2):
+        if not low <= x <= high:
+            raise ValueError(f"x = {x} is outside of the wavelength range {low} - {high}")
+    idx1 = find_index(x_values, x1)
+    idx2 = find_index(x_values, x2)
+    if idx1 == idx2:
+        raise ValueError(f"x1 = {x1} and x2 = {x2} are the same datapoint")
+    return idx1, idx2
+
+
+@stage("value")
+def get_line(df_diff, x1, x2):
+    """Calculate line equation between the datapoints closest to x1 and x2, for a 2D stack a and b are arrays"""
+    idx1, idx2 = range_indexes(df_diff[0], x1, x2)
+    x1, x2 = df_diff[0][idx1], df_diff[0][idx2]
+    y1 = df_diff[1][..., idx1]
+    y2 = df_diff[1][..., idx2]
+    a = (y2 - y1) / (x2 - x1)
+    b = y1 - a * x1
+    return(a,b)
+
+
+@stage("value")
+def get_value(df_diff, line_eq, x1, x2):
+    """
+    Calculates the value with line method.
+    Parameters:
+    - df_diff: [wavelength, difference] arrays, difference can be a 2D stack
+    - line_eq: (a, b) of the baseline, see get_line
+    - x1, x2: range of the baseline
+
+    Returns (one per row for a 2D stack):
+    - value: highest difference between baseline and signal
+    - idx_max: index in df_diff where the value was found
+    - df_value: (wavelength, baseline - signal) arrays within the range
+    """
+    a, b = line_eq
+    idx1, idx2 = range_indexes(df_diff[0], x1, x2)
+    if idx1 > idx2:
+        idx1, idx2 = idx2, idx1
+
+    x_values = df_diff[0][idx1:idx2+1]
+    # Rows of a stack get their own baseline
+    values = asarray(a)[..., None]*x_values + asarray(b)[..., None] - df_diff[1][..., idx1:idx2+1]
+
+    n = values.argmax(axis=-1)
+    return values.max(axis=-1), idx1 + n, (x_values, values)
+
+
+def decimate_minmax(x_values, y_values, bins):
+    """
+    Min/max summary of a curve for plotting, the full curve is not changed.
+    Every bin keeps its lowest and highest point in the order of the curve,
+    so peaks and dips stay visible at screen resolution.
+    Parameters:
+    - x_values, y_values: curve to summarize
+    - bins: number of bins, usually the plot width in pixels
+
+    Returns:
+    - x_values, y_values of at most 2 * (bins + 1) points
+    """
+    n = y_values.shape[0]
+    size = n // bins if bins > 0 else 0
+    if size < 2:
+        return x_values, y_values
+
+    m = size * bins
+    blocks = y_values[:m].reshape(bins, size)
+    i_min = blocks.argmin(axis=1)
+    i_max = blocks.argmax(axis=1)
+    offsets = arange(0, m, size)
+    idx = stack((minimum(i_min, i_max) + offsets, maximum(i_min, i_max) + offsets), axis=1).ravel()
+    if m < n:
+        # Points left over after the last full bin
+        tail = y_values[m:]
+        idx = concatenate((idx, sorted({m + int(tail.argmin()), m + int(tail.argmax())})))
+    return x_values[idx], y_values[idx]
@@ -0,0 +1,328 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+import os
+import re
+from os import fstat
+from os.path import getsize
+from warnings import catch_warnings, simplefilter
+from numpy import (
+    array, ascontiguousarray, concatenate, cumsum, diff, empty, flatnonzero, frombuffer, fromstring, int64, load,
+    repeat, savez, searchsorted, stack, uint8
+)
+
+from profiling import stage
+
+
+# Number of lines at the start of a file used to detect the column layout
+SAMPLE_LINES = 200
+# Rows skipped by the single column layout (no semicolons in the file)
+SINGLE_COLUMN_SKIP = 7
+# Size of the text parsed at once, bounds the memory needed on top of the output arrays
+CHUNK_BYTES = 16 * 1024 * 1024
+# Rows formatted at once by write_curve
+WRITE_ROWS = 65536
+
+# Binary dataset of many curves (.npz): one entry per curve in the curve fields,
+# the points of all curves are concatenated and curve i spans offsets[i]:offsets[i+1]
+DATASET_CURVE_FIELDS = ("name", "background", "index_name", "column_name", "result", "x_max")
+DATASET_POINT_FIELDS = ("wavelength", "value")
+# A growing dataset is a folder of such files, every append adds the next part and never rewrites the others
+DATASET_PART = "part{:06d}.npz"
+DATASET_PART_PATTERN = re.compile(r"part(\d+)\.npz")
+
+# Decimal commas become dots and semicolons become whitespace in one pass
+_TRANSLATION = bytes.maketrans(b",;", b". ")
+_NEWLINE = ord("\n")
+_SEMICOLON = ord(";")
+
+
+def is_number(element: any) -> bool:
+    #If you expect None to be passed:
+    if element is None:
+        return False
+    try:
+        float(element)
+        return True
+    except ValueError:
+        try:
+            int(element)
+            return True
+        except ValueError:
+            return False
+
+
+def detect_layout(sample):
+    """
+    Detects the column layout from the first lines of a file.
+    Parameters:
+    - sample: list of decoded lines from the start of the file
+
+    Returns:
+    - width: most frequent number of semicolon separated columns
+    - headers: merged header text of every column
+    - data_start: index in sample of the first line with numerical data
+    """
+    # Detect the most frequent number of columns (width)
+    detect_cols_n = {}
+    for line in sample:
+        cols_count = len(line.split(";"))
+        detect_cols_n[cols_count] = detect_cols_n.get(cols_count, 0) + 1
+    width = max(detect_cols_n, key=detect_cols_n.get)
+
+    if width == 1:
+        # If width is 1, skip the first rows and load the data directly
+        return width, [''], SINGLE_COLUMN_SKIP
+
+    # Find the row where numerical data starts, header rows are merged on the way
+    headers = [''] * width
+    for i, line in enumerate(sample):
+        cells = line.replace(",", ".").split(";")
+        if len(cells) != width:
+            continue
+        if all([is_number(val) for val in cells]):
+            return width, headers, i
+        headers = [" ".join(filter(None, [h.strip(), cell.strip()])) for h, cell in zip(headers, cells)]
+    raise ValueError(f"No numerical data found in the first {len(sample)} lines")
+
+
+def parse_block(buffer, width):
+    """
+    Parses semicolon separated lines with decimal commas into a 2D float array.
+    Lines that do not have exactly `width` columns are skipped.
+    """
+    raw = frombuffer(buffer, dtype=uint8)
+
+    # Line boundaries and number of separators on every line
+    ends = flatnonzero(raw == _NEWLINE)
+    if raw.size and raw[-1] != _NEWLINE:
+        ends = concatenate((ends, [raw.size]))
+    starts = concatenate(([0], ends + 1))[:ends.size]
+    separators = flatnonzero(raw == _SEMICOLON)
+    counts = searchsorted(separators, ends) - searchsorted(separators, starts)
+
+    # Drop lines with a different number of columns (footers, comments, blank lines)
+    valid = counts == width - 1
+    if width > 1 and not valid.all():
+        keep = repeat(valid, ends - starts + 1)[:raw.size]
+        buffer = raw[keep].tobytes()
+
+    with catch_warnings():
+        # Partially parsed text is reported as a warning by NumPy, raise it instead
+        simplefilter("error", DeprecationWarning)
+        try:
+            values = fromstring(buffer.translate(_TRANSLATION), sep=" ")
+        except DeprecationWarning as e:
+            raise ValueError(str(e)) from None
+
+    if width > 1 and values.size != int(valid.sum()) * width:
+        raise ValueError("Numerical block contains cells that are not numbers")
+    return values.reshape(-1, width)
+
+
+class SpectrumReader:
+    """
+    Streams the numerical block of a data file in bounded chunks.
+    The layout and headers are detected when the reader is created,
+    iterating over it yields (wavelength, value) arrays of every chunk.
+    Peak memory is one chunk of text plus its parsed columns.
+
+    with SpectrumReader(path) as reader:
+        for wavelength, value in reader:
+            ...
+    """
+    def __init__(self, path, chunk_bytes=CHUNK_BYTES):
+        self.chunk_bytes = chunk_bytes
+        self.file = open(path, 'rb')
+        try:
+            sample = []
+            for _ in range(SAMPLE_LINES):
+                line = self.file.readline()
+                if not line:
+                    break
+                sample.append(line)
+            self.width, self.headers, data_start = detect_layout([line.decode('utf-8') for line in sample])
+        except Exception:
+            self.file.close()
+            raise
+        # Data lines already read with the sample
+        self.pending = b"".join(sample[data_start:])
+        data_lines = len(sample) - data_start
+        self.line_bytes = len(self.pending) / data_lines if data_lines > 0 else 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def estimate_rows(self, file_size):
+        """Upper estimate of the number of data rows, from the length of the sampled data lines."""
+        return int(file_size / max(self.line_bytes, 1)) + 1
+
+    def __iter__(self):
+        # Small files are read at once, without allocating a whole chunk
+        chunk_bytes = max(1, min(self.chunk_bytes, fstat(self.file.fileno()).st_size - self.file.tell()))
+        while True:
+            block = self.file.read(chunk_bytes)
+            buffer = self.pending + block
+            if block:
+                # Keep the incomplete last line for the next chunk
+                cut = buffer.rfind(b"\n") + 1
+                self.pending = buffer[cut:]
+                buffer = buffer[:cut]
+            else:
+                self.pending = b""
+            if buffer:
+                raw_data = parse_block(buffer, self.width)
+                # Assume first column is wavelength and last one is value
+                yield ascontiguousarray(raw_data[:, 0]), ascontiguousarray(raw_data[:, -1])
+            if not block:
+                return
+
+
+@stage("parse")
+def process_data(path, chunk_bytes=CHUNK_BYTES):
+    """
+    This function performs initial preprocessing of a txt file into NumPy arrays.
+    The layout is detected from the first lines, the numerical block is then
+    parsed in vectorized chunks straight into the output arrays.
+    Parameters:
+    - path: Path to the file with data
+    - chunk_bytes: size of the text read at once
+
+    Returns:
+    - wavelength: NumPy array of the first column (index)
+    - value: NumPy array of the last column (data)
+    """
+    with SpectrumReader(path, chunk_bytes) as reader:
+        capacity = reader.estimate_rows(getsize(path))
+        wavelength = empty(capacity)  # First column
+        rvalue = empty(capacity)  # Last column
+        n = 0
+        for x, y in reader:
+            if n + x.shape[0] > capacity:
+                # Grow in place, the estimate was too low
+                capacity = max(n + x.shape[0], int(capacity * 1.5))
+                wavelength.resize(capacity, refcheck=False)
+                rvalue.resize(capacity, refcheck=False)
+            wavelength[n:n + x.shape[0]] = x
+            rvalue[n:n + y.shape[0]] = y
+            n += x.shape[0]
+        headers = reader.headers
+    wavelength.resize(n, refcheck=False)
+    rvalue.resize(n, refcheck=False)
+
+    return ((headers[0],wavelength), (headers[-1],rvalue))
+
+
+@stage("save")
+def write_curve(path, index_name, column_name, x_values, y_values):
+    """
+    Writes a curve to a text file with name and unit header lines.
+    Parameters:
+    - path: Path to the output file
+    - index_name, column_name: headers in "name unit" form
+    - x_values, y_values: columns of the curve
+    """
+    n1, _, u1 = index_name.partition(' ')
+    n2, _, u2 = column_name.partition(' ')
+    with open(path, 'w', encoding='utf-8', buffering=1024 * 1024) as f:
+        f.write(f"{n1}   ;{n2}\n")
+        f.write(f"{u1}   ;{u2}\n")
+        # Blocks of rows are formatted by one % operation instead of one f-string per row
+        for i in range(0, len(x_values), WRITE_ROWS):
+            block = stack((x_values[i:i + WRITE_ROWS], y_values[i:i + WRITE_ROWS]), axis=1).ravel().tolist()
+            f.write("%.6f;%.6f\n" * (len(block) // 2) % tuple(block))
+
+
+def write_curve_npz(path, index_name, column_name, x_values, y_values):
+    """Writes a curve with its headers ("name unit") to a NumPy .npz archive."""
+    with open(path, 'wb') as f:
+        savez(f, index_name=array(index_name), column_name=array(column_name),
+              wavelength=ascontiguousarray(x_values, dtype=float), value=ascontiguousarray(y_values, dtype=float))
+
+
+def make_dataset(curves):
+    """
+    Packs curves into the arrays of a binary dataset.
+    Parameters:
+    - curves: list of dicts with the DATASET_CURVE_FIELDS and DATASET_POINT_FIELDS keys
+
+    Returns:
+    - dict of arrays, see append_dataset
+    """
+    dataset = {field: array([curve[field] for curve in curves]) for field in DATASET_CURVE_FIELDS}
+    for field in DATASET_POINT_FIELDS:
+        dataset[field] = concatenate([curve[field] for curve in curves]) if curves else empty(0)
+    dataset["offsets"] = concatenate(([0], cumsum([len(curve["wavelength"]) for curve in curves], dtype=int64)))
+    return dataset
+
+
+def merge_datasets(datasets):
+    """One dataset with the curves of all datasets (dicts of arrays) in their order."""
+    datasets = [d for d in datasets if len(d["offsets"]) > 1]
+    if not datasets:
+        return make_dataset([])
+    merged = {field: concatenate([d[field] for d in datasets]) for field in DATASET_CURVE_FIELDS + DATASET_POINT_FIELDS}
+    lengths = concatenate([diff(d["offsets"]) for d in datasets])
+    merged["offsets"] = concatenate(([0], cumsum(lengths)))
+    return merged
+
+
+def write_dataset(path, dataset):
+    """Writes the arrays of one dataset to an .npz file."""
+    with open(path, 'wb') as f:
+        savez(f, **dataset)
+
+
+def dataset_parts(path):
+    """Part files of the dataset folder at path in the order they were appended."""
+    numbered = []
+    for name in os.listdir(path):
+        match = DATASET_PART_PATTERN.fullmatch(name)
+        if match is not None:
+            numbered.append((int(match.group(1)), os.path.join(path, name)))
+    return [part for _, part in sorted(numbered)]
+
+
+def read_dataset(path):
+    """
+    Arrays of a binary dataset.
+    Parameters:
+    - path: folder written by append_dataset, or a single .npz file (write_dataset, older datasets)
+    """
+    if os.path.isdir(path):
+        return merge_datasets([read_dataset(part) for part in dataset_parts(path)])
+    with load(path) as data:
+        return {field: data[field] for field in data.files}
+
+
+@stage("save")
+def append_dataset(path, parts):
+    """
+    Appends datasets to the binary dataset at path as one new part file, the folder is created if it does not exist.
+    Only the new curves are written, the parts already in the folder are not read or changed.
+    Parameters:
+    - path: folder of the dataset, a single-file dataset of an older version is moved into it as its first part
+    - parts: list of dicts of arrays from make_dataset or read_dataset
+    """
+    parts = [part for part in parts if len(part["offsets"]) > 1]
+    if not parts:
+        return
+    if os.path.isfile(path):
+        moved = f"{path}.{os.getpid()}.tmp"
+        os.replace(path, moved)
+        os.makedirs(path)
+        os.replace(moved, os.path.join(path, DATASET_PART.format(0)))
+    os.makedirs(path, exist_ok=True)
+    existing = dataset_parts(path)
+    last = DATASET_PART_PATTERN.fullmatch(os.path.basename(existing[-1])) if existing else None
+    number = int(last.group(1)) + 1 if last else 0
+    # The part appears only when it is complete, readers never see half of it
+    tmp = os.path.join(path, f"part.{os.getpid()}.tmp")
+    write_dataset(tmp, merge_datasets(parts))
+    os.replace(tmp, os.path.join(path, DATASET_PART.format(number)))
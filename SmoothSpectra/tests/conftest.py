@@ -0,0 +1,8 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+import os
+import sys
+
+# The modules of SmoothSpectra are imported by name, like SmoothSpectra.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,114 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+import os
+import pytest
+from numpy import linspace, sin, testing
+
+import batch
+import spectra_core
+from spectra_io import make_dataset, process_data, read_dataset, write_dataset
+
+
+def write_spectrum(path, x_values, phase=0.0):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("Wavelength;Intensity\nnm;counts\n")
+        for x in x_values:
+            f.write(f"{x:.3f};{1000 + 50 * sin(x / 7 + phase):.5f}\n".replace(".", ","))
+    return str(path)
+
+
+@pytest.fixture
+def spectra(tmp_path):
+    """Background and signals on the same grid, on shifted grids and on a 5 point grid"""
+    background = write_spectrum(tmp_path / "run1_bg.txt", linspace(300, 600, 3001))
+    signals = [write_spectrum(tmp_path / "run1_a.txt", linspace(400, 700, 2001), 0.1),
+               write_spectrum(tmp_path / "run1_b.txt", linspace(450, 700, 2501), 0.2),
+               write_spectrum(tmp_path / "run1_c.txt", linspace(300, 600, 3001), 0.3),
+               write_spectrum(tmp_path / "run1_d.txt", linspace(500, 500.4, 5), 0.4),
+               write_spectrum(tmp_path / "run1_e.txt", linspace(420, 640, 1501), 0.5)]
+    return background, signals
+
+
+def test_stack_matches_compute_difference(spectra):
+    background, signals = spectra
+    df1 = process_data(background)
+    loaded = [process_data(signal) for signal in signals]
+    for group in spectra_core.group_by_range(df1, loaded):
+        x_values, rows = spectra_core.stack_difference(df1, [loaded[i] for i in group])
+        for row, i in zip(rows, group):
+            expected = spectra_core.compute_difference(df1, loaded[i])
+            testing.assert_array_equal(x_values, expected[0])
+            testing.assert_allclose(row, expected[1])
+
+
+def test_stack_rejects_different_ranges(spectra):
+    background, signals = spectra
+    df1 = process_data(background)
+    with pytest.raises(ValueError):
+        spectra_core.stack_difference(df1, [process_data(signals[0]), process_data(signals[1])])
+
+
+@pytest.mark.parametrize("chunksize", [1, 2, 10])
+def test_batch_output_independent_of_chunksize(spectra, tmp_path, chunksize):
+    background, signals = spectra
+    output_dir = tmp_path / f"out{chunksize}"
+    output_dir.mkdir()
+    pairs = [(background, signal) for signal in signals]
+    # The baseline range lies within every signal, the 5 point one included
+    results = batch.run_batch(pairs, window=5, x_range=(500.1, 500.3), output_dir=str(output_dir), workers=1,
+                              chunksize=chunksize)
+    assert [r.error for r in results] == [None] * len(signals)
+
+    df1 = process_data(background)
+    for signal in signals:
+        expected = spectra_core.compute_difference(df1, process_data(signal))
+        stem = os.path.splitext(os.path.basename(signal))[0]
+        written = process_data(str(output_dir / f"{stem}_diff.txt"))
+        testing.assert_allclose(written[0][1], expected[0], atol=1e-5)
+        testing.assert_allclose(written[1][1], spectra_core.smooth(expected[1], 5), atol=1e-5)
+
+
+def test_failing_signal_does_not_fail_stack(spectra, tmp_path):
+    background, signals = spectra
+    # The 5 point signal is shorter than the window, the others are processed anyway
+    results = batch.process_group(background, signals + [str(tmp_path / "missing.txt")], window=11)
+    errors = {os.path.basename(r.signal): r.error for r in results}
+    assert errors.pop("run1_d.txt") is not None
+    assert errors.pop("missing.txt") is not None
+    assert set(errors.values()) == {None}
+
+
+def test_baseline_range_outside_of_signal_fails_the_pair(spectra):
+    background, signals = spectra
+    # 460 - 560 is outside of the 500 - 500.4 signal only
+    results = batch.process_group(background, signals, x_range=(460, 560))
+    errors = {os.path.basename(r.signal): r.error for r in results}
+    assert "outside of the wavelength range" in errors.pop("run1_d.txt")
+    assert set(errors.values()) == {None}
+    assert all(r.value == r.value for r in results if r.error is None)
+
+
+def test_batch_dataset_ignores_parts_of_an_aborted_run(tmp_path):
+    background = write_spectrum(tmp_path / "run1_bg.txt", linspace(400, 449, 50))
+    pairs = [(background, write_spectrum(tmp_path / f"run1_{i}.txt", linspace(400, 449, 50), i)) for i in range(3)]
+    path = str(tmp_path / "data")
+    # Part file of the first task of an older run which did not finish
+    stale = make_dataset([{"name": "stale.txt", "background": "bg.txt", "index_name": "Wavelength nm",
+                           "column_name": "Intensity counts", "result": 1.0, "x_max": 0.0,
+                           "wavelength": linspace(0, 3, 4), "value": linspace(0, 3, 4)}])
+    write_dataset(f"{path}.part0.tmp", stale)
+
+    results = batch.run_batch(pairs, workers=1, chunksize=2, dataset=path)
+    assert [r.error for r in results] == [None] * 3
+    batch.run_batch(pairs[:1], workers=1, dataset=path)
+
+    # One part per run
+    assert sorted(os.listdir(path)) == ["part000000.npz", "part000001.npz"]
+    dataset = read_dataset(path)
+    assert list(dataset["name"]) == ["run1_0.txt", "run1_1.txt", "run1_2.txt", "run1_0.txt"]
+    assert list(dataset["background"]) == ["run1_bg.txt"] * 4
+    offsets = dataset["offsets"]
+    testing.assert_allclose(dataset["wavelength"][offsets[2]:offsets[3]], linspace(400, 449, 50))
+    # Only the part of the older run is left
+    assert sorted(n for n in os.listdir(tmp_path) if n.endswith(".tmp")) == ["data.part0.tmp"]
@@ -0,0 +1,32 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+import os
+import json
+
+import profiling
+
+
+def write_trace(path, events):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"traceEvents": events}, f)
+
+
+def test_merge_reads_only_worker_traces_of_this_run(tmp_path):
+    path = str(tmp_path / "t.json")
+    worker_event = profiling.trace_event("smooth", 0, 1000, 4321, 1, 1, 1)
+    write_trace(tmp_path / f"t.{os.getpid()}-4321.json", [worker_event])
+    # Other traces next to it: a saved baseline, an older trace, a worker of another run
+    others = ["t.baseline.json", "t.4321.json", f"t.{os.getpid() + 1}-4321.json", f"t.{os.getpid()}-x.json"]
+    for name in others:
+        write_trace(tmp_path / name, [profiling.trace_event(name, 0, 1000, 1, 1, 1, 1)])
+
+    assert profiling.merge_worker_traces(path) == [worker_event]
+    assert sorted(os.listdir(tmp_path)) == sorted(others)
+
+
+def test_worker_output_path_names_the_main_process(monkeypatch):
+    monkeypatch.setenv(profiling.PROFILE_PID_ENV, "17")
+    recorder = profiling.Recorder()
+    recorder.path = os.path.join("out", "t.json")
+    assert recorder.output_path() == os.path.join("out", f"t.17-{os.getpid()}.json")
@@ -0,0 +1,72 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+import os
+import pytest
+from numpy import arange, testing
+
+import spectra_cache
+from spectra_cache import SpectrumCache, load_spectrum
+
+
+def write_spectrum(path, n=100):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("Wavelength;Intensity\nnm;counts\n")
+        f.writelines(f"{400 + i},0;{i},5\n" for i in range(n))
+    return str(path)
+
+
+def entries(directory):
+    return sorted(os.path.splitext(name)[0] for name in os.listdir(directory) if name.endswith(".npy"))
+
+
+@pytest.fixture
+def files(tmp_path):
+    folder = tmp_path / "data"
+    folder.mkdir()
+    return [write_spectrum(folder / f"s{i}.txt") for i in range(4)]
+
+
+def test_cached_result_equals_parsed_file(files, tmp_path):
+    cache = SpectrumCache(str(tmp_path / "cache"), 10 ** 6)
+    parsed = load_spectrum(files[0], cache)
+    cached = cache.get(files[0])
+    assert cached is not None
+    assert (cached[0][0], cached[1][0]) == (parsed[0][0], parsed[1][0])
+    testing.assert_array_equal(cached[0][1], arange(100) + 400.0)
+    testing.assert_array_equal(cached[1][1], parsed[1][1])
+
+
+def test_least_recently_used_entries_are_evicted(files, tmp_path, monkeypatch):
+    directory = str(tmp_path / "cache")
+    cache = SpectrumCache(directory, 10 ** 6)
+    for path in files[:2]:
+        load_spectrum(path, cache)
+    entry_size = cache.usage().total // 2
+    # Room for three entries, the folder is not listed again while entries are stored
+    cache.max_bytes = entry_size * 3
+    monkeypatch.setattr(spectra_cache.os, "scandir", None)
+
+    assert cache.get(files[0]) is not None  # files[1] is now the least recently used
+    for path in files[2:]:
+        load_spectrum(path, cache)
+    assert cache.get(files[1]) is None
+    assert all(cache.get(path) is not None for path in (files[0], files[2], files[3]))
+    assert len(entries(directory)) == 3
+    assert cache.usage().total == entry_size * 3
+
+
+def test_reopened_cache_lists_the_folder(files, tmp_path):
+    directory = str(tmp_path / "cache")
+    cache = SpectrumCache(directory, 10 ** 6)
+    for i, path in enumerate(files):
+        load_spectrum(path, cache)
+        os.utime(os.path.join(directory, cache.key(path) + ".json"), (i, i))
+    entry_size = cache.usage().total // 4
+
+    # Like a new process: the usage is read from the files, the oldest use time goes first
+    spectra_cache._usage.clear()
+    cache = SpectrumCache(directory, entry_size * 2)
+    assert cache.usage().total == entry_size * 4
+    cache.evict()
+    assert entries(directory) == sorted(cache.key(path) for path in files[2:])
@@ -0,0 +1,87 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+import pytest
+from numpy import interp, linspace, sin, testing
+
+import spectra_core
+from spectra_core import InterpolationPlan, compute_difference, get_plan
+
+
+def test_linear_plan_matches_numpy_interp():
+    source = linspace(400, 700, 301)
+    target = linspace(350, 650, 1201)
+    values = sin(source / 13)
+    plan = InterpolationPlan(source, target)
+    testing.assert_array_equal(plan.target, target[(target >= 400) & (target <= 700)])
+    testing.assert_allclose(plan.apply(values), interp(plan.target, source, values))
+
+
+def test_descending_source_axis():
+    source = linspace(700, 400, 301)
+    target = linspace(450, 650, 77)
+    values = sin(source / 13)
+    plan = InterpolationPlan(source, target)
+    assert plan.mask.all()
+    testing.assert_allclose(plan.apply(values), interp(target, source[::-1], values[::-1]))
+
+
+def test_cubic_plan_is_exact_for_smooth_curves():
+    pytest.importorskip("scipy")
+    source = linspace(400, 700, 301)
+    target = linspace(410, 690, 97)
+    plan = InterpolationPlan(source, target)
+    testing.assert_allclose(plan.apply(source ** 2, 'cubic'), target ** 2, rtol=1e-9)
+    with pytest.raises(ValueError):
+        plan.apply(source, 'nearest')
+
+
+@pytest.mark.parametrize("source", [linspace(400, 500, 1), linspace(800, 900, 11)])
+def test_plan_needs_overlapping_grids(source):
+    with pytest.raises(ValueError):
+        InterpolationPlan(source, linspace(400, 700, 31))
+
+
+def test_plans_are_reused_for_the_same_grids(monkeypatch):
+    monkeypatch.setattr(spectra_core, "_plans", spectra_core.OrderedDict())
+    monkeypatch.setattr(spectra_core, "PLAN_CACHE_SIZE", 2)
+    grid_a, grid_b, grid_c = linspace(400, 700, 301), linspace(401, 699, 200), linspace(402, 698, 100)
+    target = linspace(400, 700, 1001)
+
+    plan = get_plan(grid_a, target)
+    # Equal grids in other arrays hit the cache
+    assert get_plan(grid_a.copy(), target.copy()) is plan
+    plan_b = get_plan(grid_b, target)
+    assert get_plan(grid_a, target) is plan  # grid_a is now the most recently used
+    get_plan(grid_c, target)
+    assert len(spectra_core._plans) == 2
+    assert get_plan(grid_a, target) is plan
+    # grid_b was the least recently used and had to be planned again
+    assert get_plan(grid_b, target) is not plan_b
+    assert len(spectra_core._plans) == 2
+
+
+def test_difference_on_other_grid_uses_the_common_range():
+    background = (("Wavelength nm", linspace(400, 700, 301)), ("Intensity counts", linspace(0, 30, 301)))
+    signal = (("Wavelength nm", linspace(500, 800, 151)), ("Intensity counts", linspace(500, 800, 151) / 100))
+    x_values, difference = compute_difference(background, signal)
+    testing.assert_array_equal(x_values, linspace(500, 700, 201))
+    testing.assert_allclose(difference, x_values / 10 - 40 - x_values / 100)
+
+
+@pytest.mark.parametrize("x1, x2", [(100, 200), (350, 800), (250, 500), (500.01, 500.02), (500, 500)])
+def test_baseline_range_must_be_two_datapoints_of_the_axis(x1, x2):
+    x_values = linspace(300, 600, 301)
+    df_diff = [x_values, sin(x_values / 13)]
+    with pytest.raises(ValueError):
+        spectra_core.get_line(df_diff, x1, x2)
+    with pytest.raises(ValueError):
+        spectra_core.get_value(df_diff, (0.0, 0.0), x1, x2)
+
+
+def test_baseline_range_on_descending_axis():
+    x_values = linspace(600, 300, 301)
+    df_diff = [x_values, sin(x_values / 13)]
+    a, b = spectra_core.get_line(df_diff, 300, 600)
+    value, idx_max, _ = spectra_core.get_value(df_diff, (a, b), 600, 300)
+    assert 0 <= idx_max < 301 and value >= 0
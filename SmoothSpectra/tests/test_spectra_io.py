@@ -0,0 +1,189 @@
+__author__ = "Tomasz Galica"
+__license__ = "GNU"
+
+import os
+import pytest
+from numpy import arange, array, inf, nan, testing
+
+from spectra_io import (
+    SpectrumReader, append_dataset, is_number, make_dataset, process_data, read_dataset, write_curve, write_dataset
+)
+
+
+def reference_process_data(path):
+    """The line by line parser process_data replaced, for files with more than one column"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = f.readlines()
+    detect_cols_n = {}
+    for line in data:
+        cols_count = len(line.split(";"))
+        detect_cols_n[cols_count] = detect_cols_n.get(cols_count, 0) + 1
+    width = max(detect_cols_n, key=detect_cols_n.get)
+    processed_lines = array([line.replace(",", ".").split(";") for line in data if len(line.split(";")) == width])
+    num_start = 0
+    for i, line in enumerate(processed_lines):
+        if all([is_number(val) for val in line]):
+            num_start = i
+            break
+    headers = [''] * width
+    for i in range(num_start):
+        headers = [" ".join(filter(None, [h.strip(), line.strip()])) for h, line in zip(headers, processed_lines[i])]
+    raw_data = processed_lines[num_start:].astype(float)
+    return ((headers[0], raw_data[:, 0]), (headers[-1], raw_data[:, -1]))
+
+
+LAYOUTS = {
+    # Names and units, decimal commas
+    "two_columns": "Wavelength;Intensity\nnm;counts\n" + "".join(f"{400 + i * 0.5:.1f};{i * 1.25:.2f}\n".replace(".", ",")
+                                                            for i in range(300)),
+    # Instrument export with a preamble, three columns and a footer
+    "instrument": "Spectrometer export\nIntegration 100 ms\nWavelength;Dark;Signal\nnm;counts;counts\n"
+                  + "".join(f"{300 + i};{i % 5},0;{i * 2},5\n" for i in range(500)) + "End of data\n",
+    # Windows line endings and exponents
+    "crlf": "X;Y\r\nnm;a.u.\r\n" + "".join(f"{i};{i * 1e-3:e}\r\n" for i in range(200)),
+}
+
+
+@pytest.mark.parametrize("layout", sorted(LAYOUTS))
+def test_parser_matches_line_by_line_parser(tmp_path, layout):
+    path = tmp_path / f"{layout}.txt"
+    path.write_bytes(LAYOUTS[layout].encode('utf-8'))
+    parsed = process_data(str(path))
+    expected = reference_process_data(str(path))
+    assert (parsed[0][0], parsed[1][0]) == (expected[0][0], expected[1][0])
+    testing.assert_array_equal(parsed[0][1], expected[0][1])
+    testing.assert_array_equal(parsed[1][1], expected[1][1])
+
+
+def test_single_column_layout(tmp_path):
+    path = tmp_path / "single.txt"
+    path.write_text("".join(f"header {i}\n" for i in range(7)) + "".join(f"{i},5\n" for i in range(10)))
+    (x_name, x_values), (y_name, y_values) = process_data(str(path))
+    testing.assert_array_equal(x_values, arange(10) + 0.5)
+    testing.assert_array_equal(y_values, x_values)
+
+
+def test_parser_rejects_text_in_the_numerical_block(tmp_path):
+    path = tmp_path / "broken.txt"
+    path.write_text("X;Y\nnm;counts\n1;2\n3;4\n5;oops\n")
+    with pytest.raises(ValueError):
+        process_data(str(path))
+
+
+@pytest.mark.parametrize("chunk_bytes", [7, 64, 1000, 10 ** 6])
+def test_chunked_reading_matches_whole_file(tmp_path, chunk_bytes):
+    path = tmp_path / "instrument.txt"
+    # No newline at the end, the last line is completed by the end of the file
+    path.write_bytes(LAYOUTS["instrument"].replace("End of data\n", "").rstrip("\n").encode('utf-8'))
+    whole = process_data(str(path))
+    chunked = process_data(str(path), chunk_bytes)
+    testing.assert_array_equal(chunked[0][1], whole[0][1])
+    testing.assert_array_equal(chunked[1][1], whole[1][1])
+    assert len(whole[0][1]) == 500
+
+    with SpectrumReader(str(path), chunk_bytes) as reader:
+        chunks = list(reader)
+    # Lines are never split between chunks. After the sampled lines, a chunk holds at most
+    # chunk_bytes plus the rest of a line (the data lines are at least 12 bytes long)
+    assert sum(len(x) for x, _ in chunks) == 500
+    if chunk_bytes < 1000:
+        assert len(chunks) > 2
+        assert max(len(x) for x, _ in chunks[1:]) <= chunk_bytes // 12 + 1
+
+
+def test_rows_beyond_the_estimate_grow_the_output(tmp_path):
+    # Long sampled lines make the estimate of the row count too low for the short lines after them
+    path = tmp_path / "growing.txt"
+    long_lines = "".join(f"{i}.000000000000;{i}.000000000000\n" for i in range(300))
+    short_lines = "".join(f"{i};{i}\n" for i in range(300, 3000))
+    path.write_text("X;Y\nnm;counts\n" + long_lines + short_lines)
+    x_values = process_data(str(path), 256)[0][1]
+    testing.assert_array_equal(x_values, arange(3000))
+
+
+def curve(name, n, start=0.0):
+    return {"name": name, "background": "bg.txt", "index_name": "Wavelength nm", "column_name": "Intensity counts",
+            "result": float(n), "x_max": start, "wavelength": arange(n) + start, "value": arange(n) * 2.0}
+
+
+def dataset_curves(dataset):
+    """name -> (wavelength, value) of every curve of a dataset"""
+    offsets = dataset["offsets"]
+    return {str(name): (dataset["wavelength"][offsets[i]:offsets[i + 1]], dataset["value"][offsets[i]:offsets[i + 1]])
+            for i, name in enumerate(dataset["name"])}
+
+
+def test_dataset_appends_curves_of_different_lengths(tmp_path):
+    path = str(tmp_path / "data")
+    append_dataset(path, [make_dataset([curve("a", 3), curve("b", 5, 10.0)])])
+    append_dataset(path, [make_dataset([]), make_dataset([curve("c", 2)])])
+    dataset = read_dataset(path)
+    assert list(dataset["name"]) == ["a", "b", "c"]
+    assert list(dataset["offsets"]) == [0, 3, 8, 10]
+    assert list(dataset["result"]) == [3.0, 5.0, 2.0]
+    curves = dataset_curves(dataset)
+    testing.assert_array_equal(curves["b"][0], arange(5) + 10.0)
+    testing.assert_array_equal(curves["c"][1], [0.0, 2.0])
+    assert sorted(os.listdir(path)) == ["part000000.npz", "part000001.npz"]
+
+
+def test_dataset_append_does_not_rewrite_parts(tmp_path):
+    path = str(tmp_path / "data")
+    append_dataset(path, [make_dataset([curve("a", 3)])])
+    first = os.path.join(path, "part000000.npz")
+    with open(first, 'rb') as f:
+        content = f.read()
+    for i in range(11):
+        append_dataset(path, [make_dataset([curve(f"b{i}", 2)])])
+    with open(first, 'rb') as f:
+        assert f.read() == content
+    assert list(read_dataset(path)["name"]) == ["a"] + [f"b{i}" for i in range(11)]
+    # Parts are ordered by number, not by name
+    assert sorted(os.listdir(path))[-1] == "part000011.npz"
+    assert read_dataset(os.path.join(path, "part000011.npz"))["name"][0] == "b10"
+
+
+def test_single_file_dataset_becomes_first_part(tmp_path):
+    path = str(tmp_path / "data.npz")
+    write_dataset(path, make_dataset([curve("old", 4)]))
+    assert list(read_dataset(path)["name"]) == ["old"]
+    append_dataset(path, [make_dataset([curve("new", 2)])])
+    assert os.path.isdir(path)
+    assert list(read_dataset(path)["offsets"]) == [0, 4, 6]
+    assert list(read_dataset(path)["name"]) == ["old", "new"]
+    assert os.listdir(tmp_path) == ["data.npz"]
+
+
+def test_empty_dataset_folder(tmp_path):
+    append_dataset(str(tmp_path / "data"), [make_dataset([])])
+    assert os.listdir(tmp_path) == []
+    os.mkdir(tmp_path / "data")
+    assert list(read_dataset(str(tmp_path / "data"))["offsets"]) == [0]
+
+
+def reference_write_curve(path, index_name, column_name, x_values, y_values):
+    """The row by row writer write_curve replaced"""
+    n1, _, u1 = index_name.partition(' ')
+    n2, _, u2 = column_name.partition(' ')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"{n1}   ;{n2}\n")
+        f.write(f"{u1}   ;{u2}\n")
+        for x, y in zip(x_values, y_values):
+            f.write(f"{x:.6f};{y:.6f}\n")
+
+
+def test_write_curve_matches_row_by_row_writer(tmp_path, monkeypatch):
+    x_values = arange(1000) * 0.37 - 20.0
+    y_values = (arange(1000) - 500.0) ** 3 / 7.0
+    y_values[[0, 10, 11, 12, 999]] = [nan, inf, -inf, -0.0, 1e-7]
+    x_values[500] = -0.0
+    # Blocks of 64 rows, so the curve ends with a partial block
+    monkeypatch.setattr("spectra_io.WRITE_ROWS", 64)
+    for n in (0, 1, 64, 1000):
+        write_curve(str(tmp_path / "new.txt"), "Wavelength nm", "Intensity counts", x_values[:n], y_values[:n])
+        reference_write_curve(str(tmp_path / "old.txt"), "Wavelength nm", "Intensity counts",
+                              x_values[:n], y_values[:n])
+        assert (tmp_path / "new.txt").read_bytes() == (tmp_path / "old.txt").read_bytes()
+    written = (tmp_path / "new.txt").read_bytes()
+    for text in (b";nan\n", b";inf\n", b";-inf\n", b";-0.000000\n", b"\n-0.000000;"):
+        assert text in written